@@ -0,0 +1,376 @@
+"""
+Rate limiting and admission control for SemireGPT
+
+An AdmissionController sits in front of get_response() and its async and
+streaming variants. A request is admitted in two steps:
+
+1. Rate: it takes a token from its session's bucket and from the global
+   bucket. An empty bucket rejects it at once (RateLimited).
+2. Concurrency: it takes one of max_concurrent slots. When every slot is
+   busy it waits in a bounded FIFO queue; a full queue sheds the request
+   at once (Overloaded), and a request still queued at its deadline
+   gives up (DeadlineExceeded).
+
+Rejecting early keeps the queue, memory use and tail latency bounded when
+traffic spikes or the backend slows down. Threads and coroutines share
+the same slots and queue:
+
+    with controller.admit(session_id):
+        ...
+    async with controller.admit(session_id):
+        ...
+
+The process-wide controller returned by default_admission() is
+configured from SEMIRE_* environment variables and does nothing unless
+one of them is set.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from tracing import LatencyHistogram
+
+
+class Rejected(Exception):
+    """A request was not admitted; reason says why"""
+
+    reason = "rejected"
+
+
+class RateLimited(Rejected):
+    reason = "rate_limited"
+
+
+class Overloaded(Rejected):
+    reason = "overloaded"
+
+
+class DeadlineExceeded(Rejected, TimeoutError):
+    reason = "deadline"
+
+
+class TokenBucket:
+    """
+    Token bucket: rate tokens per second, holding at most burst
+
+    Args:
+        rate: Tokens added per second
+        burst: Bucket capacity (defaults to one second's worth, at least 1)
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available; return whether they were taken"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def refund(self, tokens=1):
+        """Give back tokens taken for a request that was not admitted"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + tokens)
+
+
+class _Waiter:
+    """A queued request, woken once it has been handed a slot"""
+
+    __slots__ = ("granted", "queued_ns", "event", "loop", "future")
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.queued_ns = time.perf_counter_ns()
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def signal(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _Ticket:
+    """Context manager (sync or async) holding one admitted request"""
+
+    __slots__ = ("controller", "session_id", "deadline")
+
+    def __init__(self, controller, session_id, deadline):
+        self.controller = controller
+        self.session_id = session_id
+        self.deadline = deadline
+
+    def remaining(self):
+        """Seconds left before the deadline (None without one)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def __enter__(self):
+        waiter = self.controller._enter(self)
+        if waiter is not None:
+            waiter.event.wait(self.remaining())
+            self.controller._finish_wait(waiter)
+        return self
+
+    async def __aenter__(self):
+        import asyncio
+
+        waiter = self.controller._enter(self, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future),
+                                       self.remaining())
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # Cancelled: pass the slot on if it arrived meanwhile
+                self.controller._abandon(waiter)
+                raise
+            self.controller._finish_wait(waiter)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.controller._leave()
+        return False
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.controller._leave()
+        return False
+
+
+class _Unlimited:
+    """Ticket handed out when nothing is limited"""
+
+    __slots__ = ()
+
+    def remaining(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_UNLIMITED_TICKET = _Unlimited()
+
+
+class AdmissionController:
+    """
+    Per-session and global rate limits plus a bounded admission queue
+
+    Every limit is optional; a controller with none admits everything
+    at almost no cost.
+
+    Args:
+        rate: Global requests per second (None = unlimited)
+        burst: Global bucket size
+        session_rate: Requests per second for each session
+        session_burst: Per-session bucket size
+        max_concurrent: Requests allowed in progress at once (None =
+            unlimited)
+        max_queue: Requests allowed to wait for a slot; more are shed
+        timeout: Default seconds a request may wait for a slot
+        max_sessions: Session buckets remembered (least recently used
+            ones are dropped, which refills them)
+    """
+
+    def __init__(self, rate=None, burst=None, session_rate=None,
+                 session_burst=None, max_concurrent=None, max_queue=64,
+                 timeout=None, max_sessions=10000):
+        self.global_bucket = TokenBucket(rate, burst) if rate else None
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.enabled = bool(rate or session_rate or max_concurrent)
+        self._buckets = OrderedDict()
+        self._waiters = deque()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._wait_times = LatencyHistogram()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.peak_queue = 0
+
+    def admit(self, session_id=None, timeout=None):
+        """
+        Return a context manager (for with or async with) that holds a
+        slot for one request
+
+        Raises (on entry):
+            RateLimited, Overloaded or DeadlineExceeded
+        """
+        if not self.enabled:
+            return _UNLIMITED_TICKET
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return _Ticket(self, session_id, deadline)
+
+    def stats(self):
+        """Return admission counters and queue-wait percentiles"""
+        with self._lock:
+            waits = self._wait_times
+            return {"admitted": self.admitted,
+                    "rate_limited": self.rate_limited,
+                    "shed": self.shed,
+                    "timed_out": self.timed_out,
+                    "in_flight": self._in_flight,
+                    "queued": len(self._waiters),
+                    "peak_queue": self.peak_queue,
+                    "wait_p50_ms": waits.percentile(50) / 1e6,
+                    "wait_p99_ms": waits.percentile(99) / 1e6,
+                    "wait_max_ms": waits.max / 1e6}
+
+    def _take_tokens(self, session_id):
+        session_bucket = None
+        if self.session_rate and session_id is not None:
+            with self._lock:
+                session_bucket = self._buckets.get(session_id)
+                if session_bucket is None:
+                    session_bucket = TokenBucket(self.session_rate,
+                                                 self.session_burst)
+                    self._buckets[session_id] = session_bucket
+                    if len(self._buckets) > self.max_sessions:
+                        self._buckets.popitem(last=False)
+                else:
+                    self._buckets.move_to_end(session_id)
+            if not session_bucket.try_acquire():
+                return f"session {session_id} is over its rate limit"
+        if self.global_bucket is not None and \
+                not self.global_bucket.try_acquire():
+            if session_bucket is not None:
+                session_bucket.refund()
+            return "server is over its rate limit"
+        return None
+
+    def _enter(self, ticket, loop=None):
+        """Admit, queue (returning the waiter) or reject a request"""
+        problem = self._take_tokens(ticket.session_id)
+        with self._lock:
+            if problem is not None:
+                self.rate_limited += 1
+                raise RateLimited(problem)
+            if self.max_concurrent is None or (
+                    self._in_flight < self.max_concurrent and
+                    not self._waiters):
+                self._in_flight += 1
+                self.admitted += 1
+                self._wait_times.record(0)
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.shed += 1
+                raise Overloaded(f"admission queue is full "
+                                 f"({self.max_queue} waiting)")
+            if ticket.deadline is not None and \
+                    ticket.deadline <= time.monotonic():
+                self.timed_out += 1
+                raise DeadlineExceeded("deadline passed before admission")
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            self.peak_queue = max(self.peak_queue, len(self._waiters))
+            return waiter
+
+    def _finish_wait(self, waiter):
+        """After waking or timing out: proceed if granted, else give up"""
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                self._wait_times.record(time.perf_counter_ns() -
+                                        waiter.queued_ns)
+                return
+            self._waiters.remove(waiter)
+            self.timed_out += 1
+        raise DeadlineExceeded(f"no slot within the deadline "
+                               f"({self.max_concurrent} in flight)")
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                return
+        self._leave()
+
+    def _leave(self):
+        """Release a slot, handing it straight to the oldest waiter"""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+            else:
+                self._in_flight -= 1
+                return
+        waiter.signal()
+
+
+UNLIMITED = AdmissionController()
+
+_process_admission = None
+_process_admission_lock = threading.Lock()
+
+
+def _env_number(name, convert=float):
+    value = os.getenv(name, "")
+    return convert(value) if value else None
+
+
+def default_admission():
+    """
+    Return the process-wide controller configured from the environment
+
+    SEMIRE_RATE / SEMIRE_BURST limit all sessions together,
+    SEMIRE_SESSION_RATE / SEMIRE_SESSION_BURST each session,
+    SEMIRE_MAX_CONCURRENT and SEMIRE_MAX_QUEUE size the admission queue
+    and SEMIRE_DEADLINE is the default wait in seconds. Returns UNLIMITED
+    when none of them is set.
+    """
+    global _process_admission
+    with _process_admission_lock:
+        if _process_admission is None:
+            # 0 is meaningful: shed whenever every slot is busy
+            max_queue = _env_number("SEMIRE_MAX_QUEUE", int)
+            controller = AdmissionController(
+                rate=_env_number("SEMIRE_RATE"),
+                burst=_env_number("SEMIRE_BURST"),
+                session_rate=_env_number("SEMIRE_SESSION_RATE"),
+                session_burst=_env_number("SEMIRE_SESSION_BURST"),
+                max_concurrent=_env_number("SEMIRE_MAX_CONCURRENT", int),
+                max_queue=64 if max_queue is None else max_queue,
+                timeout=_env_number("SEMIRE_DEADLINE"))
+            _process_admission = controller if controller.enabled \
+                else UNLIMITED
+        return _process_admission
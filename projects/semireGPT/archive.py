@@ -0,0 +1,365 @@
+"""
+Compressed conversation archives for SemireGPT
+
+An archive stores messages in compressed blocks of up to block_size
+messages, followed by a block index, so one turn can be read by
+decompressing a single block and a long conversation can be exported or
+replayed block by block:
+
+    header   b"SGPTARC1", codec id (1 byte), 7 reserved bytes
+    blocks   compressed JSON array of [role, content, timestamp_ns]
+    index    one entry per block: offset, compressed size, crc32,
+             first message number, message count
+    trailer  index offset, block count, message count, b"SGPTIDX1"
+
+Blocks are compressed with zlib, or with zstd when the zstandard package
+is installed and codec="zstd" is requested.
+
+Usage:
+    python archive.py create chat.json chat.sgz
+    python archive.py export chat.sgz chat.jsonl
+    python archive.py info chat.sgz
+"""
+
+import json
+import os
+import struct
+import sys
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+
+from history_store import Message, role_id_for, to_nanoseconds
+from persistence import fsync_directory
+
+ARCHIVE_MAGIC = b"SGPTARC1"
+INDEX_MAGIC = b"SGPTIDX1"
+ARCHIVE_SUFFIX = ".sgz"
+HEADER = struct.Struct("<8sB7x")
+INDEX_ENTRY = struct.Struct("<QIIQI")
+TRAILER = struct.Struct("<QIQ8s")
+CODECS = {"zlib": 0, "zstd": 1}
+
+
+def is_archive_file(filename):
+    """Return True if the file starts with the archive header"""
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd archives require the zstandard package")
+    return zstandard
+
+
+def _compressor(codec, level):
+    if codec == "zlib":
+        return lambda data: zlib.compress(data, level)
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=level).compress
+    raise ValueError(f"Unknown codec {codec!r}")
+
+
+def _decompressor(codec_id):
+    if codec_id == CODECS["zlib"]:
+        return zlib.decompress
+    if codec_id == CODECS["zstd"]:
+        return _zstd().ZstdDecompressor().decompress
+    raise ValueError(f"Unknown archive codec id {codec_id}")
+
+
+class ArchiveWriter:
+    """
+    Write messages into a new archive
+
+    The archive is built in a temporary file and renamed into place by
+    close(), so readers never see a partial archive.
+
+    Args:
+        filename: Archive path
+        block_size: Messages per compressed block (smaller blocks make
+            single-message reads cheaper, larger ones compress better)
+        codec: "zlib" or "zstd"
+        level: Compression level
+    """
+
+    def __init__(self, filename, block_size=256, codec="zlib", level=6):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.filename = filename
+        self.block_size = block_size
+        self._compress = _compressor(codec, level)
+        self._temp_path = f"{filename}.{os.getpid()}.tmp"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(HEADER.pack(ARCHIVE_MAGIC, CODECS[codec]))
+        self._pending = []
+        self._index = []
+        self.count = 0
+
+    def append(self, role, content, timestamp=None):
+        """Add one message (timestamp as ISO string or epoch seconds)"""
+        role_id_for(role)  # validates the role table limit
+        self._pending.append([role, content, to_nanoseconds(timestamp)])
+        if len(self._pending) >= self.block_size:
+            self._flush_block()
+
+    def extend(self, messages):
+        """Add Message objects or saved message dicts"""
+        for message in messages:
+            if isinstance(message, Message):
+                self._pending.append([message.role, message.content,
+                                      message.timestamp_ns])
+                if len(self._pending) >= self.block_size:
+                    self._flush_block()
+            else:
+                self.append(message["role"], message["content"],
+                            message.get("timestamp"))
+
+    def close(self):
+        """Write the index and move the archive into place"""
+        if self._file is None:
+            return
+        self._flush_block()
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(INDEX_ENTRY.pack(*entry))
+        self._file.write(TRAILER.pack(index_offset, len(self._index),
+                                      self.count, INDEX_MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self._temp_path, self.filename)
+        fsync_directory(os.path.dirname(os.path.abspath(self.filename)))
+
+    def abort(self):
+        """Discard the archive being written"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        payload = json.dumps(self._pending, ensure_ascii=False,
+                             separators=(",", ":")).encode("utf-8")
+        data = self._compress(payload)
+        self._index.append((self._file.tell(), len(data), zlib.crc32(data),
+                            self.count, len(self._pending)))
+        self._file.write(data)
+        self.count += len(self._pending)
+        self._pending = []
+
+
+def write_archive(filename, messages, **options):
+    """Write an iterable of messages to a new archive; return the count"""
+    with ArchiveWriter(filename, **options) as writer:
+        writer.extend(messages)
+    return writer.count
+
+
+class ArchiveReader:
+    """
+    Read-only, random-access view of an archive
+
+    Only the index is read when opening; history[i] decompresses the one
+    block holding message i (recently used blocks are kept decoded).
+    Works as a HistoryStore base, like LazyHistory.
+
+    Args:
+        filename: Archive path
+        cached_blocks: Decoded blocks kept in memory
+    """
+
+    def __init__(self, filename, cached_blocks=4):
+        self.filename = filename
+        self.cached_blocks = cached_blocks
+        self._file = open(filename, "rb")
+        magic, codec_id = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != ARCHIVE_MAGIC:
+            self._file.close()
+            raise ValueError(f"{filename} is not a SemireGPT archive")
+        self._decompress = _decompressor(codec_id)
+        self._file.seek(-TRAILER.size, os.SEEK_END)
+        index_offset, blocks, self._count, index_magic = TRAILER.unpack(
+            self._file.read(TRAILER.size))
+        if index_magic != INDEX_MAGIC:
+            self._file.close()
+            raise ValueError(f"{filename} has no block index (truncated?)")
+        self._file.seek(index_offset)
+        raw = self._file.read(blocks * INDEX_ENTRY.size)
+        self._index = [INDEX_ENTRY.unpack_from(raw, position)
+                       for position in range(0, len(raw), INDEX_ENTRY.size)]
+        self._firsts = [entry[3] for entry in self._index]
+        self._blocks = OrderedDict()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("archive index out of range")
+        block = bisect_right(self._firsts, index) - 1
+        role, content, timestamp_ns = \
+            self._block(block)[index - self._firsts[block]]
+        return Message.from_parts(role_id_for(role), content, timestamp_ns)
+
+    def __iter__(self):
+        for block in range(len(self._index)):
+            for role, content, timestamp_ns in self._read_block(block):
+                yield Message.from_parts(role_id_for(role), content,
+                                         timestamp_ns)
+
+    def recent(self, n):
+        """Return the last n messages"""
+        return self[max(self._count - n, 0):]
+
+    def iter_dicts(self):
+        """Yield messages in the saved-file dict shape, block by block"""
+        for message in self:
+            yield message.to_dict()
+
+    def info(self):
+        """Return a summary of the archive layout"""
+        compressed = sum(entry[1] for entry in self._index)
+        return {"messages": self._count, "blocks": len(self._index),
+                "compressed_bytes": compressed,
+                "file_bytes": os.path.getsize(self.filename)}
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def _block(self, block):
+        messages = self._blocks.get(block)
+        if messages is None:
+            messages = self._read_block(block)
+            self._blocks[block] = messages
+            if len(self._blocks) > self.cached_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(block)
+        return messages
+
+    def _read_block(self, block):
+        offset, size, crc, _, _ = self._index[block]
+        self._file.seek(offset)
+        data = self._file.read(size)
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"Corrupt block {block} in {self.filename}")
+        return json.loads(self._decompress(data))
+
+
+def read_archive(filename):
+    """Yield an archive's messages as saved-file dicts, block by block"""
+    with ArchiveReader(filename) as reader:
+        yield from reader.iter_dicts()
+
+
+def export(filename, output, fmt="jsonl"):
+    """
+    Stream an archive out as JSON Lines or a JSON array
+
+    Only one block is decoded at a time, so memory use does not depend
+    on the size of the archive.
+
+    Args:
+        filename: Archive path
+        output: Path, or a text file object (e.g. sys.stdout)
+        fmt: "jsonl" or "json"
+
+    Returns:
+        Number of messages written
+    """
+    if isinstance(output, str):
+        with open(output, "w", encoding="utf-8") as f:
+            return export(filename, f, fmt)
+    count = 0
+    if fmt == "json":
+        output.write("[")
+    for record in read_archive(filename):
+        line = json.dumps(record)
+        if fmt == "json":
+            output.write(("\n" if not count else ",\n") + "  " + line)
+        else:
+            output.write(line + "\n")
+        count += 1
+    if fmt == "json":
+        output.write("\n]\n" if count else "]\n")
+    return count
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="archive a saved conversation")
+    create.add_argument("source", help="JSON export or JSONL journal")
+    create.add_argument("archive")
+    create.add_argument("--block-size", type=int, default=256)
+    create.add_argument("--codec", choices=sorted(CODECS), default="zlib")
+    create.add_argument("--level", type=int, default=6)
+    extract = commands.add_parser("export",
+                                  help="write an archive as JSON/JSONL")
+    extract.add_argument("archive")
+    extract.add_argument("output", nargs="?", default="-",
+                         help="output file (default: stdout)")
+    extract.add_argument("--format", choices=["jsonl", "json"])
+    info = commands.add_parser("info", help="describe an archive")
+    info.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        from persistence import read_conversation
+
+        count = write_archive(args.archive, read_conversation(args.source),
+                              block_size=args.block_size, codec=args.codec,
+                              level=args.level)
+        print(f"Archived {count:,} messages to {args.archive}")
+    elif args.command == "export":
+        fmt = args.format or ("json" if args.output.endswith(".json")
+                              else "jsonl")
+        if args.output == "-":
+            export(args.archive, sys.stdout, fmt)
+        else:
+            count = export(args.archive, args.output, fmt)
+            print(f"Exported {count:,} messages to {args.output}")
+    else:
+        with ArchiveReader(args.archive) as reader:
+            for key, value in reader.info().items():
+                print(f"{key:>16}: {value:,}")
+
+
+if __name__ == "__main__":
+    main()
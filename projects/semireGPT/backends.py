@@ -0,0 +1,233 @@
+"""
+Response backends for SemireGPT
+
+A backend turns a user message into a reply. SemireGPT uses its built-in
+rule-based _simulate_response when no backend is given. To write your own,
+subclass Backend (or provide the same methods):
+
+- generate(message, context) -> reply string
+- stream(message, context) -> iterator of reply chunks (optional; the
+  base class falls back to yielding generate() in one piece)
+- close() -> release connections and other resources
+- uses_context -> False if replies never depend on earlier messages
+  (SemireGPT then skips building the context, which also lets the
+  response cache hit across turns)
+
+Available backends:
+- StubBackend: canned replies with optional fake latency, for testing
+- HTTPBackend: a model server over pooled keep-alive HTTP connections
+  (mock_server.py provides a local stand-in)
+"""
+
+import http.client
+import json
+import queue
+import random
+import threading
+import re
+import time
+from urllib.parse import urlsplit
+
+_CHUNK_RE = re.compile(r"\S+\s*|\s+")
+
+
+def split_chunks(text):
+    """Split a reply into word-sized chunks (whitespace kept)"""
+    return _CHUNK_RE.findall(text)
+
+
+class Backend:
+    """Base class for response backends"""
+
+    uses_context = True
+
+    def generate(self, message, context=None):
+        """
+        Return the reply to a message
+
+        Args:
+            message: The user's message
+            context: Earlier messages as {"role", "content"} dicts
+                (backends may ignore it)
+        """
+        raise NotImplementedError
+
+    def stream(self, message, context=None):
+        """Yield the reply in chunks as it is produced"""
+        yield self.generate(message, context)
+
+    def close(self):
+        """Release any resources held by the backend"""
+
+
+class StubBackend(Backend):
+    """
+    Local stand-in backend for load tests and offline replays
+
+    Args:
+        latency: Seconds to sleep per call, to mimic a model server
+        reply: Format string for the reply ({message} is substituted)
+    """
+
+    uses_context = False
+
+    def __init__(self, latency=0.0, reply="stub reply to: {message}"):
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+
+    def generate(self, message, context=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.reply.format(message=message)
+
+    def stream(self, message, context=None):
+        """Yield word chunks, spreading the latency across them"""
+        self.calls += 1
+        chunks = split_chunks(self.reply.format(message=message))
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            yield chunk
+
+
+class HTTPBackend(Backend):
+    """
+    Backend that POSTs to a model server over pooled keep-alive connections
+
+    Connections are reused across requests, so the TCP (and TLS) handshake
+    is paid once per connection rather than once per request. The server
+    receives {"message", "context", "system_prompt"} as JSON and must
+    answer with {"response": "..."}. Streaming requests add "stream": true
+    and expect one {"delta": "..."} JSON object per line.
+
+    Args:
+        url: Endpoint, e.g. "http://127.0.0.1:8765/v1/chat"
+        api_key: Sent as a Bearer token if given
+        max_connections: Concurrency limit (and pool size) for this backend
+        max_retries: Retries for connection errors, 429 and 5xx replies
+        backoff: Base delay in seconds for jittered exponential backoff
+        timeout: Socket timeout in seconds
+        system_prompt: Sent along with every request
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, url, api_key=None, max_connections=8, max_retries=3,
+                 backoff=0.05, timeout=30.0, system_prompt=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        self.url = url
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.system_prompt = system_prompt
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path or "/"
+        if parts.query:
+            self._path += "?" + parts.query
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = queue.LifoQueue()
+        self.requests = 0
+        self.retries = 0
+        self.connections_opened = 0
+
+    def generate(self, message, context=None):
+        payload = {"message": message, "context": context or [],
+                   "system_prompt": self.system_prompt}
+        return self.request(payload)["response"]
+
+    def stream(self, message, context=None):
+        payload = {"message": message, "context": context or [],
+                   "system_prompt": self.system_prompt, "stream": True}
+        with self._slots:
+            conn, response = self._post(payload)
+            try:
+                for line in response:
+                    if line.strip():
+                        yield json.loads(line)["delta"]
+            except BaseException:
+                # Unread data would poison the next request on this socket
+                conn.close()
+                raise
+            self._release(conn, response)
+
+    def request(self, payload):
+        """POST a JSON payload and return the decoded JSON reply"""
+        with self._slots:
+            conn, response = self._post(payload)
+            try:
+                data = response.read()
+            except BaseException:
+                conn.close()
+                raise
+            self._release(conn, response)
+            return json.loads(data)
+
+    def _post(self, payload):
+        """
+        Send a request, retrying transient failures
+
+        Returns the connection and a successful response whose body has
+        not been read yet.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json",
+                   "Connection": "keep-alive"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        for attempt in range(self.max_retries + 1):
+            conn = self._checkout()
+            try:
+                conn.request("POST", self._path, body, headers)
+                response = conn.getresponse()
+                if response.status < 400:
+                    self.requests += 1
+                    return conn, response
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if attempt == self.max_retries:
+                    raise
+            else:
+                self._release(conn, response)
+                if (response.status not in self.RETRY_STATUSES or
+                        attempt == self.max_retries):
+                    raise RuntimeError(
+                        f"Backend returned HTTP {response.status}: "
+                        f"{data[:200]!r}")
+            self.retries += 1
+            # Full jitter: spread retries out so clients don't stampede
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def _release(self, conn, response):
+        """Return a fully read connection to the pool (or close it)"""
+        if response.will_close:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close every idle pooled connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        self.connections_opened += 1
+        if self._scheme == "https":
+            return http.client.HTTPSConnection(self._host, self._port,
+                                               timeout=self.timeout)
+        return http.client.HTTPConnection(self._host, self._port,
+                                          timeout=self.timeout)
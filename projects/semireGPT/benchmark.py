@@ -0,0 +1,322 @@
+"""
+Replay benchmark for SemireGPT
+
+Generates (or loads) a corpus of synthetic conversations and replays it
+through SemireGPT.get_response() at each requested concurrency, then
+times save_conversation()/load_conversation() at each requested history
+size. Everything runs offline, against the rule-based responses or a
+StubBackend.
+
+Results are printed and can be written as JSON; --compare prints the
+change against an earlier result file, so runs from two commits can be
+checked for regressions:
+
+    python benchmark.py --output before.json
+    git checkout my-branch
+    python benchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import StubBackend
+from semire_gpt import SemireGPT
+from tracing import LatencyHistogram
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Mix of rule matches (canned replies) and free text
+CANNED = ["hello", "hi there", "how are you", "what can you do",
+          "what is your name"]
+WORDS = ("model data python answer question history server cache token "
+         "session request latency memory reply message context index "
+         "search learn build test deploy").split()
+
+
+def generate_corpus(conversations=200, turns=20, canned_ratio=0.3, seed=0):
+    """
+    Build synthetic conversations
+
+    Returns:
+        List of conversations, each a list of user messages
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(conversations):
+        messages = []
+        for _ in range(turns):
+            if rng.random() < canned_ratio:
+                messages.append(rng.choice(CANNED))
+            else:
+                messages.append(" ".join(rng.choice(WORDS)
+                                         for _ in range(rng.randint(3, 25))))
+        corpus.append(messages)
+    return corpus
+
+
+def save_corpus(corpus, filename):
+    """Write one conversation per JSON line"""
+    with open(filename, "w") as f:
+        for messages in corpus:
+            f.write(json.dumps(messages) + "\n")
+
+
+def load_corpus(filename):
+    """Read a corpus written by save_corpus()"""
+    with open(filename, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(histogram, count, elapsed):
+    """Throughput and latency percentiles (ms) from a histogram"""
+    return {
+        "operations": count,
+        "seconds": elapsed,
+        "throughput_per_s": count / elapsed if elapsed else 0.0,
+        "mean_ms": histogram.total / histogram.count / 1e6
+        if histogram.count else 0.0,
+        "p50_ms": histogram.percentile(50) / 1e6,
+        "p99_ms": histogram.percentile(99) / 1e6,
+        "p999_ms": histogram.percentile(99.9) / 1e6,
+        "max_ms": histogram.max / 1e6,
+    }
+
+
+def make_session(backend="rules", stub_latency=0.0, **options):
+    """Create a SemireGPT wired to an offline backend"""
+    if backend == "stub":
+        options["backend"] = StubBackend(latency=stub_latency)
+    elif backend != "rules":
+        raise ValueError(f"unknown backend {backend!r}")
+    return SemireGPT(**options)
+
+
+def replay(corpus, concurrency=1, backend="rules", stub_latency=0.0):
+    """
+    Replay every conversation through get_response()
+
+    Each conversation runs in order on its own session; up to
+    concurrency conversations run at once on separate threads.
+    """
+    histograms = []
+
+    def run(messages):
+        histogram = LatencyHistogram()
+        gpt = make_session(backend, stub_latency)
+        try:
+            for message in messages:
+                start = time.perf_counter_ns()
+                gpt.get_response(message)
+                histogram.record(time.perf_counter_ns() - start)
+        finally:
+            gpt.close()
+        histograms.append(histogram)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run, messages)
+                       for messages in corpus]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    result = summarize(merged, merged.count, elapsed)
+    result["concurrency"] = concurrency
+    return result
+
+
+def save_load(corpus, history_size, repeats=3, new_messages=10):
+    """
+    Time saving and loading a session with history_size messages
+
+    Each repeat does a full save to a new file, then adds new_messages
+    and saves again (an incremental save), then loads the file back.
+    """
+    messages = [message for conversation in corpus
+                for message in conversation]
+    gpt = make_session()
+    for number in range(history_size):
+        role = "user" if number % 2 == 0 else "assistant"
+        gpt.add_to_history(role, messages[number % len(messages)])
+
+    save_times = LatencyHistogram()
+    append_times = LatencyHistogram()
+    load_times = LatencyHistogram()
+    directory = tempfile.mkdtemp(prefix="semire_bench_")
+    loader = make_session()
+    # save/load report with print(); keep the benchmark output readable
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        for repeat in range(repeats):
+            filename = os.path.join(directory, f"conversation{repeat}.json")
+            start = time.perf_counter_ns()
+            gpt.save_conversation(filename)
+            save_times.record(time.perf_counter_ns() - start)
+            for number in range(new_messages):
+                gpt.add_to_history("user", messages[number % len(messages)])
+            start = time.perf_counter_ns()
+            gpt.save_conversation(filename)
+            append_times.record(time.perf_counter_ns() - start)
+            start = time.perf_counter_ns()
+            loader.load_conversation(filename)
+            load_times.record(time.perf_counter_ns() - start)
+    gpt.close()
+    loader.close()
+    size = sum(os.path.getsize(os.path.join(directory, name))
+               for name in os.listdir(directory)) // repeats
+    shutil.rmtree(directory)
+    return {
+        "history_size": history_size,
+        "file_bytes": size,
+        "save": summarize(save_times, repeats, save_times.total / 1e9),
+        "incremental_save": summarize(append_times, repeats,
+                                      append_times.total / 1e9),
+        "load": summarize(load_times, repeats, load_times.total / 1e9),
+    }
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(corpus, concurrency=(1, 4), history_sizes=(1000, 10000),
+                  backend="rules", stub_latency=0.0, repeats=3):
+    """Run every replay and save/load case and return the results dict"""
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "backend": backend,
+        "stub_latency": stub_latency,
+        "conversations": len(corpus),
+        "messages": sum(len(messages) for messages in corpus),
+        "replay": [],
+        "save_load": [],
+    }
+    for workers in concurrency:
+        results["replay"].append(replay(corpus, workers, backend,
+                                        stub_latency))
+    for size in history_sizes:
+        results["save_load"].append(save_load(corpus, size, repeats))
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def _metrics(results):
+    """Flatten a results dict into {label: value} for comparison"""
+    metrics = {}
+    for case in results["replay"]:
+        label = f"replay c={case['concurrency']}"
+        metrics[f"{label} throughput/s"] = case["throughput_per_s"]
+        metrics[f"{label} p99 ms"] = case["p99_ms"]
+    for case in results["save_load"]:
+        label = f"history={case['history_size']}"
+        metrics[f"{label} save p50 ms"] = case["save"]["p50_ms"]
+        if "incremental_save" in case:
+            metrics[f"{label} incremental save p50 ms"] = \
+                case["incremental_save"]["p50_ms"]
+        metrics[f"{label} load p50 ms"] = case["load"]["p50_ms"]
+    if results.get("peak_rss_mb") is not None:
+        metrics["peak RSS MB"] = results["peak_rss_mb"]
+    return metrics
+
+
+def print_report(results, baseline=None):
+    """Print the results, with % change against a baseline if given"""
+    print(f"SemireGPT benchmark ({results['backend']} backend, "
+          f"{results['conversations']:,} conversations, "
+          f"{results['messages']:,} messages, commit {results['commit']})")
+    old = _metrics(baseline) if baseline else {}
+    for label, value in _metrics(results).items():
+        line = f"{label:>32}: {value:,.3f}"
+        if old.get(label):
+            line += f"  ({(value - old[label]) / old[label]:+.1%})"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20,
+                        help="user messages per conversation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", metavar="FILE",
+                        help="replay this corpus instead of generating one")
+    parser.add_argument("--save-corpus", metavar="FILE",
+                        help="write the generated corpus to FILE")
+    parser.add_argument("--concurrency", default="1,4",
+                        help="comma-separated thread counts to replay at")
+    parser.add_argument("--history-sizes", default="1000,10000",
+                        help="comma-separated history sizes for save/load")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="save/load repetitions per history size")
+    parser.add_argument("--backend", choices=["rules", "stub"],
+                        default="rules")
+    parser.add_argument("--stub-latency", type=float, default=0.0,
+                        help="seconds per StubBackend call")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = generate_corpus(args.conversations, args.turns,
+                                 seed=args.seed)
+        if args.save_corpus:
+            save_corpus(corpus, args.save_corpus)
+
+    results = run_benchmark(
+        corpus,
+        concurrency=[int(n) for n in args.concurrency.split(",")],
+        history_sizes=[int(n) for n in args.history_sizes.split(",")],
+        backend=args.backend, stub_latency=args.stub_latency,
+        repeats=args.repeats)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Bulk conversion, validation and merging of conversation files
+
+Works on whole directories of saved conversations (JSON snapshots, JSONL
+journals and .sgz archives, in any mix) using a pool of worker
+processes:
+
+    python bulk.py convert sessions/ exported/ --to sgz
+    python bulk.py validate sessions/
+    python bulk.py merge old_sessions/ new_sessions/ merged/ --to jsonl
+
+Files are handed to the workers in chunks, with only a few chunks in
+flight at a time, and every file is streamed from its source to an
+atomically written destination, so memory stays flat however many files
+there are. Progress (files, messages and throughput) is reported on
+stderr as the work runs.
+
+merge combines the files that share a name (their path relative to
+each source directory, ignoring the extension: the session id) into one
+conversation ordered by timestamp, dropping messages that appear in more
+than one source.
+"""
+
+import heapq
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from archive import ARCHIVE_SUFFIX, write_archive
+from history_store import parse_timestamp
+from persistence import (INDEX_SUFFIX, WAL_SUFFIX, atomic_write,
+                         encode_message, encode_snapshot, read_conversation)
+
+FORMATS = {"json": ".json", "jsonl": ".jsonl", "sgz": ARCHIVE_SUFFIX}
+# Errors kept per file; a badly broken file should not flood the report
+MAX_PROBLEMS = 5
+
+
+def conversation_files(directory):
+    """
+    Find the saved conversations under a directory
+
+    Returns:
+        Sorted list of paths; a JSON snapshot that currently exists only
+        as write-ahead logs is listed under its snapshot name
+    """
+    found = set()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if WAL_SUFFIX in name:
+                name = name[:name.index(WAL_SUFFIX)]
+            elif name.endswith(INDEX_SUFFIX):
+                continue
+            if os.path.splitext(name)[1] in FORMATS.values():
+                found.add(os.path.join(root, name))
+    return sorted(found)
+
+
+def session_name(path, directory):
+    """Path relative to directory, without its extension"""
+    return os.path.splitext(os.path.relpath(path, directory))[0]
+
+
+def write_conversation(filename, records, fmt):
+    """
+    Stream message dicts into a new file in the given format
+
+    Returns:
+        Number of messages written
+    """
+    count = 0
+
+    def counted():
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    if fmt == "sgz":
+        write_archive(filename, counted())
+    elif fmt == "jsonl":
+        atomic_write(filename, (
+            encode_message(record["role"], record["content"],
+                           parse_timestamp(record.get("timestamp")))
+            for record in counted()))
+    else:
+        atomic_write(filename, encode_snapshot(counted()))
+    return count
+
+
+def validate_record(record):
+    """Return a description of what is wrong with a message dict, or None"""
+    if not isinstance(record, dict):
+        return f"not an object: {record!r:.60}"
+    for field in ("role", "content"):
+        if not isinstance(record.get(field), str):
+            return f"missing or non-string {field!r}"
+    if "timestamp" in record:
+        try:
+            parse_timestamp(record["timestamp"])
+        except (TypeError, ValueError):
+            return f"bad timestamp {record['timestamp']!r:.40}"
+    return None
+
+
+def _timestamp_key(record):
+    # Microseconds: what survives a round trip through an ISO timestamp
+    try:
+        return round(parse_timestamp(record["timestamp"]), 6)
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def _merged(sources):
+    """Messages from several files, by timestamp, without duplicates"""
+    streams = [iter(read_conversation(path)) for path in sources]
+    if len(streams) == 1:
+        yield from streams[0]
+        return
+    recent = set()
+    current = None
+    for record in heapq.merge(*streams, key=_timestamp_key):
+        # Duplicates share a timestamp, so only that group is remembered
+        key = _timestamp_key(record)
+        if key != current:
+            current = key
+            recent.clear()
+        identity = (record["role"], record["content"])
+        if identity not in recent:
+            recent.add(identity)
+            yield record
+
+
+def _new_result():
+    return {"files": 0, "messages": 0, "bytes": 0, "failed": []}
+
+
+def convert_chunk(jobs, fmt):
+    """
+    Worker task: write each (sources, destination) job in fmt
+
+    Returns:
+        Result dict with files, messages, input bytes and failures
+    """
+    result = _new_result()
+    for sources, destination in jobs:
+        try:
+            result["messages"] += write_conversation(
+                destination, _merged(sources), fmt)
+        except Exception as e:
+            result["failed"].append(
+                (destination, [f"{type(e).__name__}: {e}"]))
+        result["files"] += 1
+        result["bytes"] += sum(_size(path) for path in sources)
+    return result
+
+
+def validate_chunk(paths):
+    """
+    Worker task: read every message of each file and check its shape
+
+    Returns:
+        Result dict; failures list each bad file with its first problems
+    """
+    result = _new_result()
+    for path in paths:
+        problems = []
+        try:
+            for number, record in enumerate(read_conversation(path)):
+                problem = validate_record(record)
+                if problem is not None:
+                    problems.append(f"message {number}: {problem}")
+                    if len(problems) >= MAX_PROBLEMS:
+                        break
+                result["messages"] += 1
+        except Exception as e:
+            problems.append(f"{type(e).__name__}: {e}")
+        if problems:
+            result["failed"].append((path, problems))
+        result["files"] += 1
+        result["bytes"] += _size(path)
+    return result
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0  # only logs exist, or the file vanished
+
+
+class Progress:
+    """
+    Running totals with a throughput line redrawn on a stream
+
+    Args:
+        total: Files expected
+        stream: Where to report (None for silence)
+        interval: Seconds between redraws
+    """
+
+    def __init__(self, total, stream=sys.stderr, interval=1.0):
+        self.total = total
+        self.stream = stream
+        self.interval = interval
+        self.totals = _new_result()
+        self.start = time.perf_counter()
+        self._last_report = 0.0
+
+    def add(self, result):
+        """Fold in one chunk's result dict"""
+        for field in ("files", "messages", "bytes"):
+            self.totals[field] += result[field]
+        self.totals["failed"].extend(result["failed"])
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._draw()
+
+    def summary(self):
+        """Return the totals with elapsed time and rates"""
+        elapsed = time.perf_counter() - self.start
+        summary = dict(self.totals, seconds=elapsed)
+        for field in ("files", "messages", "bytes"):
+            summary[f"{field}_per_s"] = \
+                self.totals[field] / elapsed if elapsed else 0.0
+        return summary
+
+    def finish(self):
+        """Draw the final line and return summary()"""
+        self._draw()
+        if self.stream is not None:
+            self.stream.write("\n")
+        return self.summary()
+
+    def _draw(self):
+        if self.stream is None:
+            return
+        summary = self.summary()
+        self.stream.write(
+            f"\r{summary['files']:,}/{self.total:,} files  "
+            f"{summary['messages']:,} messages  "
+            f"{summary['files_per_s']:,.0f} files/s  "
+            f"{summary['messages_per_s']:,.0f} msg/s  "
+            f"{summary['bytes_per_s'] / 1e6:,.1f} MB/s  "
+            f"{len(summary['failed'])} failed")
+        self.stream.flush()
+
+
+def run_chunks(task, items, args=(), workers=None, chunk_size=64,
+               progress=None):
+    """
+    Run task(chunk, *args) over items in a process pool
+
+    At most two chunks per worker are queued at once, so neither the
+    pending work nor the results pile up in memory.
+
+    Returns:
+        The Progress summary
+    """
+    workers = workers or os.cpu_count() or 1
+    progress = progress or Progress(len(items), stream=None)
+    chunks = (items[start:start + chunk_size]
+              for start in range(0, len(items), chunk_size))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    progress.add(future.result())
+            pending.add(executor.submit(task, chunk, *args))
+        for future in pending:
+            progress.add(future.result())
+    return progress.finish()
+
+
+def plan_merge(sources, destination, fmt):
+    """
+    Group the files of the source directories by session
+
+    Returns:
+        List of (source paths, destination path) jobs
+    """
+    groups = {}
+    for directory in sources:
+        for path in conversation_files(directory):
+            groups.setdefault(session_name(path, directory), []).append(path)
+    return [(paths, os.path.join(destination, name + FORMATS[fmt]))
+            for name, paths in sorted(groups.items())]
+
+
+def convert(sources, destination, fmt="jsonl", workers=None, chunk_size=64,
+            stream=sys.stderr):
+    """
+    Write every conversation in the source directories to destination
+
+    With one source this converts each file; with several, files that
+    share a session name are merged (see _merged).
+
+    Returns:
+        Summary dict (files, messages, bytes, failed, seconds and rates)
+    """
+    jobs = plan_merge(sources, destination, fmt)
+    return run_chunks(convert_chunk, jobs, (fmt,), workers, chunk_size,
+                      Progress(len(jobs), stream))
+
+
+def validate(directory, workers=None, chunk_size=64, stream=sys.stderr):
+    """Check every conversation under directory; return the summary"""
+    paths = conversation_files(directory)
+    return run_chunks(validate_chunk, paths, (), workers, chunk_size,
+                      Progress(len(paths), stream))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="files per worker task")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser(
+        "convert", help="rewrite a directory in another format")
+    convert_parser.add_argument("source")
+    convert_parser.add_argument("destination")
+    merge_parser = commands.add_parser(
+        "merge", help="merge directories, combining files per session")
+    merge_parser.add_argument("sources", nargs="+")
+    merge_parser.add_argument("destination")
+    for command in (convert_parser, merge_parser):
+        command.add_argument("--to", choices=sorted(FORMATS),
+                             default="jsonl", help="output format")
+    validate_parser = commands.add_parser(
+        "validate", help="check that every file reads back cleanly")
+    validate_parser.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    if args.command == "validate":
+        summary = validate(args.directory, args.workers, args.chunk_size)
+    else:
+        sources = [args.source] if args.command == "convert" else args.sources
+        summary = convert(sources, args.destination, args.to, args.workers,
+                          args.chunk_size)
+    print(f"{summary['files']:,} files, {summary['messages']:,} messages "
+          f"in {summary['seconds']:.1f}s "
+          f"({summary['messages_per_s']:,.0f} messages/s)")
+    for path, problems in summary["failed"]:
+        print(f"FAILED {path}")
+        for problem in problems:
+            print(f"    {problem}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
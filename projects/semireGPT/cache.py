@@ -0,0 +1,158 @@
+"""
+Response cache for SemireGPT
+
+Identical prompts (after normalizing case and whitespace) with the same
+system prompt and context are answered from the cache instead of the
+backend. The in-memory tier is a size-bounded LRU with optional TTL; an
+optional sqlite file adds a larger disk tier that survives restarts.
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize(message):
+    """Normalize a prompt so trivially different spellings share a key"""
+    return _WHITESPACE_RE.sub(" ", message).strip().casefold()
+
+
+def make_key(message, system_prompt="", context=()):
+    """
+    Build a cache key
+
+    Args:
+        message: The user's message
+        system_prompt: The system prompt in effect
+        context: Earlier messages as {"role", "content"} dicts
+    """
+    digest = hashlib.sha256()
+    for part in (system_prompt, normalize(message)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    for msg in context:
+        digest.update(f"{msg['role']}\0{msg['content']}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of responses with an optional sqlite disk tier
+
+    Args:
+        max_entries: Maximum responses kept in memory
+        ttl: Seconds before an entry expires (None = never)
+        disk_path: sqlite file for the disk tier (None = memory only)
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached response for key, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            if self._db is not None:
+                value = self._disk_get(key)
+                if value is not None:
+                    self.disk_hits += 1
+                    self._remember(key, value, now)
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store a response (in memory, and on disk if enabled)"""
+        with self._lock:
+            self._remember(key, value, time.monotonic())
+            if self._db is not None:
+                expires = None if self.ttl is None else time.time() + self.ttl
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                    (key, value, expires))
+                self._db.commit()
+
+    def clear(self):
+        """Drop every cached response from both tiers"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss/eviction counters"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.disk_hits) / lookups
+            if lookups else 0.0,
+        }
+
+    def close(self):
+        """Close the disk tier"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key, value, now):
+        expires = None if self.ttl is None else now + self.ttl
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key):
+        row = self._db.execute(
+            "SELECT value, expires FROM responses WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+            self.expirations += 1
+            return None
+        return value
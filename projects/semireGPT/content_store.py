@@ -0,0 +1,240 @@
+"""
+Content deduplication for SemireGPT
+
+Many message bodies repeat: canned rule-based replies, cached answers,
+"hello". Two stores keep one copy of each repeated body:
+
+- ContentStore (memory): a process-wide table shared by every
+  HistoryStore, so a reply that appears in a thousand sessions is held
+  once and each history keeps only a small integer id for it.
+- BlobStore (disk): an sqlite table of bodies keyed by a content hash,
+  shared by every journal in a directory; journal lines refer to a body
+  by its hash instead of repeating it.
+
+A body is only deduplicated once it has been seen twice (and is long
+enough to be worth a reference), so unique messages cost nothing extra.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+BLOBS_FILE = "blobs.db"
+
+
+def content_hash(content):
+    """Stable hash of a message body (hex), used as its on-disk reference"""
+    import hashlib
+
+    digest = hashlib.blake2b(content.encode("utf-8"), digest_size=10)
+    return digest.hexdigest()
+
+
+class _RepeatFilter:
+    """Remembers recently seen keys so a body is shared on its 2nd use"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._seen = OrderedDict()
+
+    def seen_before(self, key):
+        if key in self._seen:
+            del self._seen[key]
+            return True
+        self._seen[key] = None
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return False
+
+
+class ContentStore:
+    """
+    Reference-counted table of message bodies shared across histories
+
+    Args:
+        min_length: Shorter bodies are never shared (an id would not save
+            anything)
+        candidates: How many recently seen unshared bodies are remembered
+            while waiting for a repeat
+    """
+
+    def __init__(self, min_length=16, candidates=4096):
+        self.min_length = min_length
+        self._ids = {}          # content -> id
+        self._contents = []     # id -> content (None once released)
+        self._refcounts = []
+        self._free = []
+        self._candidates = _RepeatFilter(candidates)
+        self._lock = threading.Lock()
+        self.shared_chars = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def ref(self, content):
+        """
+        Take a reference to content
+
+        Returns:
+            The content's id (call release() when done with it), or None
+            if the content should be stored inline
+        """
+        if len(content) < self.min_length:
+            return None
+        with self._lock:
+            content_id = self._ids.get(content)
+            if content_id is None:
+                if not self._candidates.seen_before(hash(content)):
+                    return None
+                content_id = self._add(content)
+            else:
+                self.hits += 1
+            self._refcounts[content_id] += 1
+            return content_id
+
+    def get(self, content_id):
+        """Return the content for an id"""
+        return self._contents[content_id]
+
+    def release(self, content_id):
+        """Drop a reference; the body is freed with its last reference"""
+        with self._lock:
+            self._refcounts[content_id] -= 1
+            if not self._refcounts[content_id]:
+                content = self._contents[content_id]
+                del self._ids[content]
+                self._contents[content_id] = None
+                self._free.append(content_id)
+                self.shared_chars -= len(content)
+
+    def stats(self):
+        """Return counters describing the table"""
+        with self._lock:
+            return {"entries": len(self._ids),
+                    "references": sum(self._refcounts),
+                    "shared_chars": self.shared_chars,
+                    "hits": self.hits}
+
+    def _add(self, content):
+        if self._free:
+            content_id = self._free.pop()
+            self._contents[content_id] = content
+        else:
+            content_id = len(self._contents)
+            self._contents.append(content)
+            self._refcounts.append(0)
+        self._ids[content] = content_id
+        self.shared_chars += len(content)
+        return content_id
+
+
+_shared_content = None
+_shared_content_lock = threading.Lock()
+
+
+def shared_content():
+    """Return the process-wide ContentStore used by HistoryStore"""
+    global _shared_content
+    with _shared_content_lock:
+        if _shared_content is None:
+            _shared_content = ContentStore()
+        return _shared_content
+
+
+class BlobStore:
+    """
+    Content-addressed message bodies in an sqlite file
+
+    Safe to share between threads and between processes (the server's
+    worker processes all write to one file per data directory).
+
+    Args:
+        path: sqlite file
+        min_length: Shorter bodies are written inline instead
+        candidates: Recently seen bodies remembered while waiting for a
+            repeat
+    """
+
+    def __init__(self, path, min_length=32, candidates=4096):
+        self.path = path
+        self.min_length = min_length
+        self._candidates = _RepeatFilter(candidates)
+        self._known = OrderedDict()   # recently used hash -> content
+        self._lock = threading.Lock()
+        import sqlite3
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS blobs ("
+                         "hash TEXT PRIMARY KEY, content TEXT)")
+        self._db.commit()
+
+    def ref(self, content):
+        """
+        Return the hash to write instead of content, or None to write it
+        inline (first sighting, or too short)
+        """
+        if len(content) < self.min_length:
+            return None
+        digest = content_hash(content)
+        with self._lock:
+            if digest in self._known:
+                self._known.move_to_end(digest)
+                return digest
+            if not self._candidates.seen_before(digest):
+                return None
+            self._db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)",
+                             (digest, content))
+            self._db.commit()
+            self._remember(digest, content)
+            return digest
+
+    def get(self, digest):
+        """Return the body stored under a hash"""
+        with self._lock:
+            content = self._known.get(digest)
+            if content is not None:
+                self._known.move_to_end(digest)
+                return content
+            row = self._db.execute("SELECT content FROM blobs WHERE hash = ?",
+                                   (digest,)).fetchone()
+            if row is None:
+                raise KeyError(f"Unknown content reference {digest} in "
+                               f"{self.path}")
+            self._remember(digest, row[0])
+            return row[0]
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, digest, content):
+        self._known[digest] = content
+        if len(self._known) > self._candidates.capacity:
+            self._known.popitem(last=False)
+
+
+_blob_stores = {}
+_blob_stores_lock = threading.Lock()
+
+
+def blob_store_for(journal_path):
+    """Return the (process-wide) BlobStore next to a journal file"""
+    path = os.path.join(os.path.dirname(os.path.abspath(journal_path)),
+                        BLOBS_FILE)
+    with _blob_stores_lock:
+        store = _blob_stores.get(path)
+        if store is None:
+            store = _blob_stores[path] = BlobStore(path)
+        return store
+
+
+def resolve(record, journal_path):
+    """Fill in "content" for a journal record that holds a "ref" """
+    if "ref" in record:
+        record["content"] = blob_store_for(journal_path).get(record.pop("ref"))
+    return record
@@ -0,0 +1,152 @@
+"""
+Token-budgeted context window for SemireGPT
+
+ContextBuilder keeps the most recent messages that fit a token budget,
+together with each message's token count and a running total. Each new
+turn is tokenized once and the oldest turns are dropped (or folded into a
+summary) as needed, so building the prompt never re-walks the whole
+history.
+
+Token counts come from tiktoken when it is installed and from a simple
+word/punctuation estimate otherwise.
+"""
+
+import re
+from collections import deque
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+
+
+def estimate_tokens(text):
+    """Rough token count: one per word or punctuation mark"""
+    return len(_TOKEN_RE.findall(text))
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken if available, else estimate them"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding is False:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text))
+
+
+class ContextBuilder:
+    """
+    Recent conversation that fits within a token budget
+
+    Args:
+        system_prompt: Counted against the budget on every prompt
+        budget: Maximum tokens for the system prompt plus context
+        tokenizer: Function returning a token count for a string
+        summarizer: Optional function(evicted_messages, previous_summary)
+            returning a new summary string; the summary is kept as a
+            system message in front of the recent turns
+    """
+
+    def __init__(self, system_prompt="", budget=3000, tokenizer=None,
+                 summarizer=None):
+        self.budget = budget
+        self.tokenizer = tokenizer or count_tokens
+        self.summarizer = summarizer
+        self._messages = deque()
+        self._total = 0
+        self._summary = None
+        self._summary_tokens = 0
+        self._system_prompt = None
+        self._system_tokens = 0
+        self.system_prompt = system_prompt
+
+    @property
+    def system_prompt(self):
+        return self._system_prompt
+
+    @system_prompt.setter
+    def system_prompt(self, prompt):
+        if prompt != self._system_prompt:
+            self._system_prompt = prompt
+            self._system_tokens = self.tokenizer(prompt) if prompt else 0
+            self._fit()
+
+    @property
+    def total_tokens(self):
+        """Tokens used by the system prompt, summary and recent turns"""
+        return self._system_tokens + self._summary_tokens + self._total
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, role, content):
+        """Add a turn, evicting the oldest turns if over budget"""
+        tokens = self.tokenizer(content)
+        self._messages.append((role, content, tokens))
+        self._total += tokens
+        self._fit()
+
+    def messages(self):
+        """Return the context as {"role", "content"} dicts, oldest first"""
+        context = []
+        if self._summary:
+            summary = f"Earlier conversation: {self._summary}"
+            context.append({"role": "system", "content": summary})
+        context.extend({"role": role, "content": content}
+                       for role, content, _ in self._messages)
+        return context
+
+    def rebuild(self, history):
+        """
+        Refill from a history sequence, newest first, until the budget is
+        full (only the turns that fit are read)
+        """
+        if hasattr(history, "recent"):
+            recent = history.recent
+        else:
+            history = list(history)
+            recent = lambda n: history[max(len(history) - n, 0):]
+        self.clear()
+        room = self.budget - self._system_tokens
+        # Fetch growing batches of recent turns until the budget is full
+        fetch = 64
+        while True:
+            batch = recent(fetch)
+            newest = []
+            used = 0
+            for message in reversed(batch):
+                tokens = self.tokenizer(message.content)
+                if used + tokens > room:
+                    break
+                used += tokens
+                newest.append((message.role, message.content, tokens))
+            if len(newest) < len(batch) or len(batch) < fetch:
+                break
+            fetch *= 4
+        for entry in reversed(newest):
+            self._messages.append(entry)
+            self._total += entry[2]
+
+    def clear(self):
+        """Forget every turn and the summary"""
+        self._messages.clear()
+        self._total = 0
+        self._summary = None
+        self._summary_tokens = 0
+
+    def _fit(self):
+        evicted = []
+        # Always keep the newest turn, even if it alone is over budget
+        while self.total_tokens > self.budget and len(self._messages) > 1:
+            role, content, tokens = self._messages.popleft()
+            self._total -= tokens
+            evicted.append({"role": role, "content": content})
+        if evicted and self.summarizer is not None:
+            self._summary = self.summarizer(evicted, self._summary)
+            self._summary_tokens = self.tokenizer(self._summary)
+            # A long summary can push recent turns out as well
+            while self.total_tokens > self.budget and len(self._messages) > 1:
+                self._total -= self._messages.popleft()[2]
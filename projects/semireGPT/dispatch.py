@@ -0,0 +1,125 @@
+"""
+Worker pool for fanning SemireGPT requests out over threads
+
+Each worker owns a bounded queue. Tasks are routed by key (a session id),
+so every task for one session runs on the same worker in the order it
+was submitted, while different sessions run in parallel. A full queue
+makes submit() wait, which pushes back on producers instead of letting
+memory grow.
+"""
+
+import queue
+import threading
+import zlib
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+def shard_for(key, workers):
+    """Map a key to a worker/shard index (stable across processes)"""
+    if isinstance(key, int):
+        return key % workers
+    return zlib.crc32(str(key).encode("utf-8")) % workers
+
+
+class WorkerPool:
+    """
+    Fixed set of worker threads with per-worker bounded queues
+
+    Args:
+        workers: Number of worker threads
+        queue_size: Maximum waiting tasks per worker
+    """
+
+    def __init__(self, workers=4, queue_size=64):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self._queues = [queue.Queue(maxsize=queue_size)
+                        for _ in range(workers)]
+        self._threads = []
+        for number, tasks in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(tasks,),
+                                      name=f"semire-worker-{number}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._closed = False
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) on the key's worker; return a Future"""
+        if self._closed:
+            raise RuntimeError("WorkerPool is shut down")
+        future = Future()
+        self._queues[shard_for(key, self.workers)].put(
+            (future, fn, args, kwargs))
+        return future
+
+    async def asubmit(self, key, fn, *args, **kwargs):
+        """
+        Async version of submit() that awaits the result
+
+        While the worker's queue is full this yields to the event loop
+        rather than blocking it.
+        """
+        import asyncio
+
+        if self._closed:
+            raise RuntimeError("WorkerPool is shut down")
+        future = Future()
+        tasks = self._queues[shard_for(key, self.workers)]
+        delay = 0.001
+        while True:
+            try:
+                tasks.put_nowait((future, fn, args, kwargs))
+                break
+            except queue.Full:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self, wait=True):
+        """Stop the workers after the queued tasks finish"""
+        if self._closed:
+            return
+        self._closed = True
+        for tasks in self._queues:
+            tasks.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        return False
+
+    @staticmethod
+    def _run(tasks):
+        while True:
+            task = tasks.get()
+            if task is _STOP:
+                return
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """Return the process-wide pool shared by aget_response() calls"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = WorkerPool()
+        return _default_pool
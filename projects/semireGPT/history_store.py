@@ -0,0 +1,409 @@
+"""
+History storage for SemireGPT
+
+Keeps a session's conversation history under a fixed memory ceiling:
+- A columnar in-memory window of recent turns: int64 nanosecond
+  timestamps, one-byte role ids and offsets into a UTF-8 content buffer
+  (no per-message Python objects until a message is read); bodies that
+  repeat across the process, like canned replies, are kept once in a
+  shared ContentStore and referenced by id
+- Older turns spill to an on-disk segment of binary records
+- An optional read-only base (e.g. a LazyHistory over a saved journal)
+  that holds everything loaded before this session
+
+Message objects are built only when a message is accessed, and ISO
+timestamp strings only when a message is exported with to_dict().
+
+Any object with append(), extend(), clear(), __len__() and __iter__() can be
+plugged into SemireGPT in place of HistoryStore.
+"""
+
+import struct
+import time
+import weakref
+from array import array
+from datetime import datetime
+from itertools import islice
+
+from content_store import shared_content
+
+ROLES = ["system", "user", "assistant"]
+ROLE_IDS = {role: role_id for role_id, role in enumerate(ROLES)}
+
+# Spilled record header: timestamp (ns), role id, content length (bytes)
+RECORD_HEADER = struct.Struct("<qBI")
+
+
+def role_id_for(role):
+    """Return the small integer id for a role, registering new roles"""
+    role_id = ROLE_IDS.get(role)
+    if role_id is None:
+        if len(ROLES) > 255:
+            raise ValueError("Too many distinct roles")
+        role_id = len(ROLES)
+        ROLES.append(role)
+        ROLE_IDS[role] = role_id
+    return role_id
+
+
+def parse_timestamp(value):
+    """Convert an ISO string or epoch number to epoch seconds"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def to_nanoseconds(value):
+    """Convert an ISO string or epoch seconds to integer nanoseconds"""
+    if value is None:
+        return time.time_ns()
+    return int(round(parse_timestamp(value) * 1e9))
+
+
+class Message:
+    """A single conversation turn, stored without a per-instance __dict__"""
+
+    __slots__ = ("role_id", "content", "timestamp_ns")
+
+    def __init__(self, role, content, timestamp=None):
+        self.role_id = role_id_for(role)
+        self.content = content
+        self.timestamp_ns = to_nanoseconds(timestamp)
+
+    @classmethod
+    def from_parts(cls, role_id, content, timestamp_ns):
+        """Build a message from stored columns without re-validating"""
+        message = cls.__new__(cls)
+        message.role_id = role_id
+        message.content = content
+        message.timestamp_ns = timestamp_ns
+        return message
+
+    @property
+    def role(self):
+        return ROLES[self.role_id]
+
+    @property
+    def timestamp(self):
+        """Epoch seconds"""
+        return self.timestamp_ns / 1e9
+
+    def isoformat(self):
+        """Local-time ISO string for the timestamp"""
+        return datetime.fromtimestamp(self.timestamp).isoformat()
+
+    def __getitem__(self, key):
+        """Allow msg["role"] style access used by older code"""
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        if key == "timestamp":
+            return self.isoformat()
+        raise KeyError(key)
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+    def to_dict(self):
+        """Return the message in the JSON shape used by saved files"""
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": self.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a message from a saved dict"""
+        return cls(data["role"], data["content"], data.get("timestamp"))
+
+
+def _release_refs(content_store, refs):
+    """Release every shared-content id in refs (-1 marks inline bodies)"""
+    for content_id in refs:
+        if content_id >= 0:
+            content_store.release(content_id)
+
+
+class HistoryStore:
+    """
+    Conversation history with a bounded in-memory window
+
+    The window holds between max_in_memory // 2 and max_in_memory of the
+    newest messages: when it fills up, the oldest half is spilled to disk
+    in one batch, so the columns are compacted only occasionally.
+
+    Args:
+        max_in_memory: Maximum number of messages kept in memory
+        spill_path: File that receives older messages (a temporary file
+            that is deleted on close is used when omitted)
+        content_store: ContentStore for repeated bodies (defaults to the
+            process-wide one; False stores every body inline)
+    """
+
+    def __init__(self, max_in_memory=1000, spill_path=None,
+                 content_store=None):
+        if max_in_memory < 1:
+            raise ValueError("max_in_memory must be at least 1")
+        self.max_in_memory = max_in_memory
+        self.spill_path = spill_path
+        self._timestamps = array("q")
+        self._roles = array("B")
+        self._starts = array("Q")      # offsets into _content
+        self._refs = array("i")        # ContentStore ids, -1 = inline
+        self._content = bytearray()
+        if content_store is None:
+            content_store = shared_content()
+        elif content_store is False:
+            content_store = None
+        self.content_store = content_store
+        if content_store is not None:
+            # A history that is dropped without close() must not pin its
+            # shared bodies in the process-wide table forever
+            finalizer = weakref.finalize(self, _release_refs, content_store,
+                                         self._refs)
+            finalizer.atexit = False
+        self._last_ns = 0
+        self._spilled = 0
+        self._segment = None
+        self._base = None
+
+    def __len__(self):
+        return self._base_len() + self._spilled + len(self._roles)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        """Yield every message, oldest first, reading spilled ones from disk"""
+        if self._base is not None:
+            yield from self._base
+        first = self._spilled
+        stop = first + len(self._roles)
+        yield from self._iter_spilled()
+        # Appends (and spills) may happen while iterating: walk the window
+        # by absolute position and stop at the length seen up front
+        for absolute in range(first, stop):
+            position = absolute - self._spilled
+            if position >= 0:
+                yield self._window_message(position)
+            else:
+                yield next(islice(self._iter_spilled(), absolute, None))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(*index.indices(len(self)))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        base_len = self._base_len()
+        if index < base_len:
+            return self._base[index]
+        index -= base_len
+        if index >= self._spilled:
+            return self._window_message(index - self._spilled)
+        return next(islice(self._iter_spilled(), index, None))
+
+    @property
+    def spilled(self):
+        """Number of messages currently stored on disk"""
+        return self._spilled
+
+    @property
+    def in_memory(self):
+        """Number of messages in the in-memory window"""
+        return len(self._roles)
+
+    def set_base(self, base):
+        """
+        Use a read-only sequence of messages as the oldest part of history
+
+        The base is not copied into memory, so loading a huge saved
+        conversation this way costs nothing up front.
+        """
+        self.clear()
+        self._base = base
+
+    def append(self, role, content, timestamp=None):
+        """Add a message, spilling the oldest ones if the window is full"""
+        timestamp_ns = to_nanoseconds(timestamp)
+        if timestamp is None:
+            # Keep generated timestamps strictly increasing
+            timestamp_ns = max(timestamp_ns, self._last_ns + 1)
+        self._last_ns = max(self._last_ns, timestamp_ns)
+        self._timestamps.append(timestamp_ns)
+        self._roles.append(role_id_for(role))
+        self._starts.append(len(self._content))
+        content_id = None
+        if self.content_store is not None:
+            content_id = self.content_store.ref(content)
+        if content_id is None:
+            self._refs.append(-1)
+            self._content += content.encode("utf-8")
+        else:
+            self._refs.append(content_id)
+        if len(self._roles) > self.max_in_memory:
+            self._spill_oldest(len(self._roles) - self.max_in_memory // 2)
+
+    def extend(self, messages):
+        """Append saved message dicts (or Message objects)"""
+        for data in messages:
+            if isinstance(data, Message):
+                self.append(data.role, data.content, data.timestamp)
+            else:
+                self.append(data["role"], data["content"],
+                            data.get("timestamp"))
+
+    def recent(self, n):
+        """Return the last n messages (only touches disk if n > window)"""
+        count = len(self._roles)
+        if n <= count:
+            return [self._window_message(position)
+                    for position in range(count - n, count)]
+        return self[max(len(self) - n, 0):]
+
+    def pages(self, page_size=20, start=0):
+        """Yield lists of at most page_size messages, oldest first"""
+        page = []
+        for message in islice(self, start, None):
+            page.append(message)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def to_list(self):
+        """Return all messages as JSON-ready dicts"""
+        return [message.to_dict() for message in self]
+
+    def clear(self):
+        """Drop every message, including the spilled segment and base"""
+        self._close_base()
+        self._release(len(self._refs))
+        del self._timestamps[:]
+        del self._roles[:]
+        del self._starts[:]
+        del self._refs[:]
+        self._content.clear()
+        self._spilled = 0
+        if self._segment is not None:
+            self._segment.seek(0)
+            self._segment.truncate()
+
+    def close(self):
+        """Close the spill segment (temporary segments are deleted)"""
+        self._close_base()
+        self._release(len(self._refs))
+        del self._refs[:]
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _content_end(self, position):
+        if position + 1 < len(self._starts):
+            return self._starts[position + 1]
+        return len(self._content)
+
+    def _window_content(self, position):
+        content_id = self._refs[position]
+        if content_id >= 0:
+            return self.content_store.get(content_id)
+        start = self._starts[position]
+        return self._content[start:self._content_end(position)].decode(
+            "utf-8")
+
+    def _window_message(self, position):
+        return Message.from_parts(self._roles[position],
+                                  self._window_content(position),
+                                  self._timestamps[position])
+
+    def _release(self, count):
+        """Drop the shared-content references of the oldest count messages"""
+        if self.content_store is not None:
+            _release_refs(self.content_store, self._refs[:count])
+
+    def _slice(self, start, stop, step):
+        """Read a slice with one pass over the spilled segment"""
+        if step != 1:
+            positions = range(start, stop, step)
+            if not positions:
+                return []
+            low = min(positions)
+            chunk = self._slice(low, max(positions) + 1, 1)
+            return [chunk[position - low] for position in positions]
+        result = []
+        base_len = self._base_len()
+        if start < base_len:
+            result.extend(self._base[start:min(stop, base_len)])
+        spilled_start = max(start - base_len, 0)
+        spilled_stop = min(stop - base_len, self._spilled)
+        if spilled_start < spilled_stop:
+            result.extend(islice(self._iter_spilled(), spilled_start,
+                                 spilled_stop))
+        window_start = max(start - base_len - self._spilled, 0)
+        window_stop = stop - base_len - self._spilled
+        result.extend(self._window_message(position)
+                      for position in range(window_start, window_stop))
+        return result
+
+    def _base_len(self):
+        return 0 if self._base is None else len(self._base)
+
+    def _close_base(self):
+        if self._base is not None and hasattr(self._base, "close"):
+            self._base.close()
+        self._base = None
+
+    def _open_segment(self):
+        if self._segment is None:
+            if self.spill_path:
+                self._segment = open(self.spill_path, "w+b")
+            else:
+                import tempfile
+                self._segment = tempfile.TemporaryFile(
+                    "w+b", prefix="semire_history_", suffix=".bin")
+        return self._segment
+
+    def _spill_oldest(self, count):
+        """Move the oldest count messages to disk and compact the columns"""
+        records = []
+        for position in range(count):
+            content = self._window_content(position).encode("utf-8")
+            records.append(RECORD_HEADER.pack(self._timestamps[position],
+                                              self._roles[position],
+                                              len(content)))
+            records.append(content)
+        segment = self._open_segment()
+        segment.seek(0, 2)
+        segment.write(b"".join(records))
+
+        cut = self._content_end(count - 1)
+        self._release(count)
+        del self._timestamps[:count]
+        del self._roles[:count]
+        del self._starts[:count]
+        del self._refs[:count]
+        del self._content[:cut]
+        self._starts = array("Q", [start - cut for start in self._starts])
+        self._spilled += count
+
+    def _iter_spilled(self):
+        if not self._spilled:
+            return
+        segment = self._segment
+        segment.flush()
+        position = 0
+        header_size = RECORD_HEADER.size
+        for _ in range(self._spilled):
+            # Re-seek each time: appends may move the file position
+            segment.seek(position)
+            timestamp_ns, role_id, length = RECORD_HEADER.unpack(
+                segment.read(header_size))
+            content = segment.read(length).decode("utf-8")
+            position += header_size + length
+            yield Message.from_parts(role_id, content, timestamp_ns)
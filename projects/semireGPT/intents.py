@@ -0,0 +1,258 @@
+"""
+Intent matching for SemireGPT's rule-based responses
+
+Rules are plain data (a name, trigger phrases and a reply). They are
+compiled once into an Aho-Corasick automaton over words, so matching is a
+single pass over the message no matter how many rules are loaded, and
+phrases only match whole words ("hi" does not match inside "this").
+
+When several rules match, the one listed first wins, just like the old
+if/elif chain.
+
+Compiled tables are cached on disk (see load_matcher()), keyed by a hash
+of the rules, so a large rule set is compiled once rather than on every
+start. The cache lives in $SEMIRE_CACHE_DIR, or ~/.cache/semiregpt.
+
+Run `python intents.py --bench` to benchmark 10k synthetic rules.
+"""
+
+import marshal
+import os
+import re
+import sys
+import time
+import zlib
+from array import array
+from collections import deque, namedtuple
+
+Rule = namedtuple("Rule", ["name", "phrases", "response"])
+
+WORD_RE = re.compile(r"\w+")
+NO_MATCH = sys.maxsize
+
+DEFAULT_RULES = [
+    Rule("greeting", ["hello", "hi"],
+         "Hello! I'm SemireGPT. How can I help you today?"),
+    Rule("wellbeing", ["how are you"],
+         "I'm functioning well, thank you! How can I assist you?"),
+    Rule("capabilities", ["what can you do", "help"],
+         "I'm SemireGPT, currently in development. "
+         "I can have basic conversations, but I'm being enhanced "
+         "to become a fully custom AI assistant!"),
+    Rule("name", ["name"],
+         "My name is SemireGPT - a custom AI being developed!"),
+]
+
+
+def tokenize(text):
+    """Split text into lower-case words"""
+    return WORD_RE.findall(text.lower())
+
+
+class IntentMatcher:
+    """Compiled rule table: finds the highest-priority rule in one pass"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._goto = [{}]
+        self._fail = [0]
+        # Best (lowest) rule index that ends at each node
+        self._best = [NO_MATCH]
+        for priority, rule in enumerate(self.rules):
+            for phrase in rule.phrases:
+                self._add_phrase(tokenize(phrase), priority)
+        self._link_failures()
+        # Flatten the trie into one {(node, word): child} dict: faster to
+        # save and load than one dict per node
+        self._edges = {(node, word): child
+                       for node, children in enumerate(self._goto)
+                       for word, child in children.items()}
+        self._fail = array("q", self._fail)
+        self._best = array("q", self._best)
+        del self._goto
+
+    @classmethod
+    def from_tables(cls, rules, tables):
+        """Rebuild a matcher for rules from the output of tables()"""
+        edges, fail, best = tables
+        matcher = cls.__new__(cls)
+        matcher.rules = list(rules)
+        matcher._edges = edges
+        matcher._fail = array("q")
+        matcher._fail.frombytes(fail)
+        matcher._best = array("q")
+        matcher._best.frombytes(best)
+        return matcher
+
+    def tables(self):
+        """Return the compiled automaton as plain, marshal-able data"""
+        return self._edges, self._fail.tobytes(), self._best.tobytes()
+
+    def match(self, message):
+        """Return the matching Rule with the highest priority, or None"""
+        edges, fail, best_at = self._edges, self._fail, self._best
+        node = 0
+        best = NO_MATCH
+        for word in tokenize(message):
+            while node and (node, word) not in edges:
+                node = fail[node]
+            node = edges.get((node, word), 0)
+            if best_at[node] < best:
+                best = best_at[node]
+                if best == 0:
+                    break
+        return None if best == NO_MATCH else self.rules[best]
+
+    def _add_phrase(self, words, priority):
+        if not words:
+            return
+        node = 0
+        for word in words:
+            next_node = self._goto[node].get(word)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][word] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(NO_MATCH)
+            node = next_node
+        self._best[node] = min(self._best[node], priority)
+
+    def _link_failures(self):
+        """Breadth-first pass that sets failure links and merges outputs"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                self._best[child] = min(self._best[child],
+                                        self._best[self._fail[child]])
+                queue.append(child)
+
+
+def default_cache_dir():
+    """Directory for cached compiled artifacts"""
+    return os.getenv("SEMIRE_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "semiregpt")
+
+
+def rules_digest(rules):
+    """Short fingerprint of a rule table, used as its cache key"""
+    crc = adler = length = 0
+    for rule in rules:
+        text = "\x00".join([rule.name, *rule.phrases, rule.response,
+                            "\x01"]).encode("utf-8")
+        crc = zlib.crc32(text, crc)
+        adler = zlib.adler32(text, adler)
+        length += len(text)
+    return f"{crc:08x}{adler:08x}{length:x}"
+
+
+def load_matcher(rules, cache_dir=None):
+    """
+    Return a compiled IntentMatcher, reusing a cached compile if possible
+
+    Args:
+        rules: List of Rule
+        cache_dir: Where compiled tables are cached (defaults to
+            default_cache_dir(); False disables the cache)
+    """
+    rules = list(rules)
+    if cache_dir is False:
+        return IntentMatcher(rules)
+    directory = cache_dir or default_cache_dir()
+    # marshal's format can change between Python versions
+    path = os.path.join(directory, f"intents-{sys.implementation.cache_tag}-"
+                                   f"{rules_digest(rules)}.marshal")
+    try:
+        with open(path, "rb") as f:
+            return IntentMatcher.from_tables(rules, marshal.loads(f.read()))
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    matcher = IntentMatcher(rules)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(marshal.dumps(matcher.tables()))
+        os.replace(temp_path, path)
+    except OSError:
+        pass  # e.g. a read-only home directory: just skip the cache
+    return matcher
+
+
+_default_matcher = None
+
+
+def default_matcher():
+    """Return the matcher for DEFAULT_RULES (loaded on first use)"""
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = load_matcher(DEFAULT_RULES)
+    return _default_matcher
+
+
+def __getattr__(name):
+    # DEFAULT_MATCHER used to be built at import time; keep the name
+    # working without paying for it up front
+    if name == "DEFAULT_MATCHER":
+        return default_matcher()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def benchmark(num_rules=10000, num_messages=20000, seed=0):
+    """
+    Compare the compiled matcher with a naive substring scan
+
+    Returns a dict of timings (seconds) and per-message costs (µs).
+    """
+    import random
+
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(num_rules * 2)]
+    rules = [Rule(f"rule{i}", [" ".join(rng.sample(vocabulary,
+                                                   rng.randint(1, 3)))],
+                  f"reply {i}")
+             for i in range(num_rules)]
+    messages = [" ".join(rng.choice(vocabulary) for _ in range(12))
+                for _ in range(num_messages)]
+
+    start = time.perf_counter()
+    matcher = IntentMatcher(rules)
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for message in messages:
+        matcher.match(message)
+    match_time = time.perf_counter() - start
+
+    # The old approach: one substring scan per phrase, per message
+    naive_messages = messages[:max(num_messages // 100, 1)]
+    start = time.perf_counter()
+    for message in naive_messages:
+        lowered = message.lower()
+        for rule in rules:
+            if any(phrase in lowered for phrase in rule.phrases):
+                break
+    naive_time = time.perf_counter() - start
+
+    return {
+        "rules": num_rules,
+        "messages": num_messages,
+        "compile_s": compile_time,
+        "match_s": match_time,
+        "match_us_per_message": match_time / num_messages * 1e6,
+        "naive_us_per_message": naive_time / len(naive_messages) * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        for key, value in benchmark().items():
+            print(f"{key:>22}: {value:,.2f}" if isinstance(value, float)
+                  else f"{key:>22}: {value:,}")
+    else:
+        print(__doc__)
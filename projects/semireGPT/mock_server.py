@@ -0,0 +1,169 @@
+"""
+Local stand-in model server for SemireGPT
+
+Speaks the same JSON protocol HTTPBackend expects and answers with the
+rule-based replies from intents.py, so backend throughput and latency can
+be measured offline.
+
+Usage:
+    python mock_server.py --port 8765 --latency 0.02
+    python mock_server.py --bench 2000 --concurrency 16
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import HTTPBackend, split_chunks
+from dispatch import WorkerPool
+from intents import default_matcher
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Handles POST requests with keep-alive (HTTP/1.1)"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm and delayed ACKs add ~40 ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length))
+            message = payload["message"]
+        except (ValueError, KeyError):
+            self._reply(400, {"error": "expected JSON with a 'message'"})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        rule = default_matcher().match(message)
+        response = rule.response if rule else f"mock reply to: {message}"
+        if payload.get("stream"):
+            self._stream(response)
+        else:
+            self._reply(200, {"response": response})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, response):
+        """Send the reply word by word as chunked JSON lines"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in split_chunks(response):
+            line = json.dumps({"delta": chunk}).encode("utf-8") + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        """Keep the console quiet during benchmarks"""
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with configurable artificial latency
+
+    Args:
+        latency: Seconds to wait before answering (time to first byte)
+        chunk_delay: Seconds between streamed chunks
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0,
+                 chunk_delay=0.0):
+        super().__init__((host, port), MockHandler)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat"
+
+    def start(self):
+        """Serve from a background thread and return self"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def bench(requests=2000, concurrency=16, latency=0.0):
+    """Drive HTTPBackend against a local MockServer and report latency"""
+    server = MockServer(latency=latency).start()
+    backend = HTTPBackend(server.url, max_connections=concurrency)
+    latencies = []
+
+    def call(number):
+        start = time.perf_counter()
+        backend.generate(f"hello number {number}")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with WorkerPool(workers=concurrency) as pool:
+        futures = [pool.submit(n, call, n) for n in range(requests)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    backend.close()
+    server.stop()
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_rps": requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "connections_opened": backend.connections_opened,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds of artificial latency per request")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="seconds between streamed chunks")
+    parser.add_argument("--bench", type=int, metavar="N",
+                        help="send N requests through HTTPBackend and exit")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.bench:
+        for key, value in bench(args.bench, args.concurrency,
+                                args.latency).items():
+            print(f"{key:>20}: {value:,.2f}" if isinstance(value, float)
+                  else f"{key:>20}: {value:,}")
+        return
+
+    server = MockServer(args.host, args.port, args.latency, args.chunk_delay)
+    print(f"Mock model server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping mock server")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+"""
+Conversation persistence for SemireGPT
+
+Journal mode writes one compact JSON line per message to an append-only
+log, so saving costs O(1) per message instead of rewriting the whole
+history. Reading streams the log back and stops cleanly at a torn last
+line left behind by a crash.
+
+Each journal has a side-car offset index (<journal>.idx, one native
+uint64 per line) so LazyHistory can memory-map the journal and decode any
+message with a single seek.
+
+JSON exports are saved by SnapshotLog: a snapshot file (a plain JSON
+array) replaced atomically, plus write-ahead logs of the messages saved
+since, which are folded into a new snapshot in the background once they
+grow past a size threshold.
+"""
+
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from array import array
+
+from content_store import resolve
+from history_store import Message
+
+INDEX_SUFFIX = ".idx"
+OFFSET_SIZE = array("Q").itemsize
+
+
+def encode_message(role, content, timestamp, ref=None):
+    """
+    Return one journal line (bytes) for a message
+
+    With ref (a BlobStore hash) the line refers to the body instead of
+    holding it.
+    """
+    if ref is None:
+        record = {"role": role, "content": content, "timestamp": timestamp}
+    else:
+        record = {"role": role, "ref": ref, "timestamp": timestamp}
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def read_journal(filename):
+    """
+    Yield message dicts from a journal file
+
+    A last line without a trailing newline (or that fails to parse) is
+    treated as a torn write and skipped. Corruption anywhere else raises
+    ValueError. Lines that refer to a shared body are resolved through
+    the BlobStore next to the journal.
+    """
+    with open(filename, "rb") as f:
+        pending = None
+        for line in f:
+            if pending is not None:
+                yield resolve(pending, filename)
+                pending = None
+            if not line.endswith(b"\n"):
+                return
+            if not line.strip():
+                continue
+            try:
+                pending = json.loads(line)
+            except ValueError:
+                # Only acceptable if this turns out to be the last line
+                if f.read(1):
+                    raise ValueError(f"Corrupt journal line in {filename}")
+                return
+        if pending is not None:
+            yield resolve(pending, filename)
+
+
+def index_path(filename):
+    """Return the side-car index path for a journal"""
+    return filename + INDEX_SUFFIX
+
+
+def _complete_size(f, size):
+    """Return the length of the file up to and including its last newline"""
+    position = size
+    while position > 0:
+        start = max(position - 4096, 0)
+        f.seek(start)
+        newline = f.read(position - start).rfind(b"\n")
+        if newline != -1:
+            return start + newline + 1
+        position = start
+    return 0
+
+
+def update_index(filename):
+    """
+    Bring a journal's offset index up to date and return the line count
+
+    Entries pointing past the last complete line (torn or not yet flushed
+    writes) are dropped, and lines not yet indexed are scanned and added,
+    so the cost is proportional to the unindexed tail only.
+    """
+    idx_name = index_path(filename)
+    with open(filename, "rb") as journal, open(idx_name, "a+b") as idx:
+        journal.seek(0, os.SEEK_END)
+        valid_end = _complete_size(journal, journal.tell())
+        idx.seek(0, os.SEEK_END)
+        count = idx.tell() // OFFSET_SIZE
+
+        def offset_at(position):
+            idx.seek(position * OFFSET_SIZE)
+            return array("Q", idx.read(OFFSET_SIZE))[0]
+
+        while count and offset_at(count - 1) >= valid_end:
+            count -= 1
+        scan_from = 0
+        if count:
+            last = offset_at(count - 1)
+            journal.seek(max(last - 1, 0))
+            if last and journal.read(1) != b"\n":
+                count = 0  # index does not match this file, rebuild it
+            else:
+                journal.seek(last)
+                journal.readline()
+                scan_from = journal.tell()
+        idx.truncate(count * OFFSET_SIZE)
+
+        new_offsets = array("Q")
+        journal.seek(scan_from)
+        position = scan_from
+        while position < valid_end:
+            line = journal.readline()
+            new_offsets.append(position)
+            position += len(line)
+        idx.seek(0, os.SEEK_END)
+        new_offsets.tofile(idx)
+        return count + len(new_offsets)
+
+
+class LazyHistory:
+    """
+    Read-only view of a journal that decodes messages on access
+
+    The journal and its index are memory-mapped, so opening the view costs
+    the same for ten messages or ten million, and history[i] is one seek.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._count = update_index(filename)
+        self._data = self._offsets = None
+        self._maps = []
+        if self._count:
+            self._data = self._map(filename)
+            self._offsets = memoryview(self._map(index_path(filename))).cast(
+                "Q")[:self._count]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("history index out of range")
+        start = self._offsets[index]
+        end = self._data.find(b"\n", start)
+        record = json.loads(self._data[start:end])
+        return Message.from_dict(resolve(record, self.filename))
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def recent(self, n):
+        """Return the last n messages"""
+        return self[max(self._count - n, 0):]
+
+    def close(self):
+        """Release the memory maps"""
+        if self._offsets is not None:
+            self._offsets.release()
+            self._offsets = None
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+        self._data = None
+        self._count = 0
+
+    def _map(self, filename):
+        # The map keeps its own descriptor, so the file need not stay open
+        with open(filename, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+
+def is_journal_file(filename):
+    """Return True if the file looks like a JSONL journal (not a JSON array)"""
+    from archive import is_archive_file
+
+    if not os.path.exists(filename) or is_archive_file(filename):
+        return False
+    with open(filename, "rb") as f:
+        for line in f:
+            stripped = line.lstrip()
+            if stripped:
+                return not stripped.startswith(b"[")
+    return True
+
+
+class ConversationJournal:
+    """
+    Append-only, buffered message log with optional group-commit fsync
+
+    Args:
+        filename: Path of the journal file (created if missing)
+        sync_every: fsync after this many appends (None = only on
+            flush(sync=True) and close())
+        sync_interval: Also fsync if this many seconds passed since the
+            last sync (None = disabled)
+        blobs: BlobStore for repeated message bodies (see content_store);
+            lines for those bodies hold a reference instead of the text
+    """
+
+    def __init__(self, filename, sync_every=None, sync_interval=None,
+                 blobs=None):
+        self.filename = filename
+        self.blobs = blobs
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._repair_tail()
+        self._file = open(filename, "ab")
+        self._position = self._file.seek(0, os.SEEK_END)
+        update_index(filename)
+        self._index = open(index_path(filename), "ab")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, role, content, timestamp):
+        """Write one message to the journal"""
+        ref = None if self.blobs is None else self.blobs.ref(content)
+        line = encode_message(role, content, timestamp, ref)
+        self._file.write(line)
+        self._index.write(array("Q", [self._position]).tobytes())
+        self._position += len(line)
+        self._unsynced += 1
+        if self.sync_every and self._unsynced >= self.sync_every:
+            self.flush(sync=True)
+        elif (self.sync_interval is not None and
+              time.monotonic() - self._last_sync >= self.sync_interval):
+            self.flush(sync=True)
+
+    def flush(self, sync=False):
+        """Push buffered lines to the OS, and to disk if sync is True"""
+        self._file.flush()
+        self._index.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def truncate(self):
+        """Discard every journaled message"""
+        self._file.flush()
+        self._file.truncate(0)
+        self._index.flush()
+        self._index.truncate(0)
+        self._position = 0
+        self._unsynced = 0
+
+    def close(self):
+        """Flush, fsync and close the journal"""
+        if self._file is not None and not self._file.closed:
+            self.flush(sync=True)
+            self._file.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def _repair_tail(self):
+        """Cut off a torn last line so new appends start on a fresh line"""
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Walk back to the previous newline
+            position = size
+            chunk_size = 4096
+            while position > 0:
+                start = max(position - chunk_size, 0)
+                f.seek(start)
+                chunk = f.read(position - start)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    f.truncate(start + newline + 1)
+                    return
+                position = start
+            f.truncate(0)
+
+
+WAL_SUFFIX = ".wal."
+
+
+def fsync_directory(directory):
+    """Make renames and deletions in a directory durable (best effort)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # e.g. Windows, where directories cannot be opened
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Read once at import: changing the umask to read it is not thread-safe
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def _file_mode(filename):
+    """Mode for a replacement file: the target's, or what open() gives"""
+    try:
+        return os.stat(filename).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+def atomic_write(filename, chunks):
+    """
+    Replace a file with the given byte chunks, all or nothing
+
+    The data goes to a temporary file in the same directory, which is
+    fsynced and then renamed over the target, so a crash leaves either
+    the old file or the new one. The file keeps the target's permissions
+    (or gets the umask's, like open(), when it is new).
+    """
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(
+        prefix=os.path.basename(filename) + ".", suffix=".tmp",
+        dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file owner-only (0600)
+        os.chmod(temp_path, _file_mode(filename))
+        os.replace(temp_path, filename)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+
+def encode_record(record):
+    """Return one compact JSON line (bytes) for a log record"""
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def encode_snapshot(records):
+    """Yield a JSON array of message dicts, one message per line"""
+    separator = b"[\n"
+    for record in records:
+        yield separator + json.dumps(record).encode("utf-8")
+        separator = b",\n"
+    yield b"[]\n" if separator == b"[\n" else b"\n]\n"
+
+
+def wal_files(filename):
+    """Return [(generation, path)] for a snapshot's logs, oldest first"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    pattern = re.compile(re.escape(os.path.basename(filename) + WAL_SUFFIX) +
+                         r"(\d+)$")
+    found = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            found.append((int(match.group(1)),
+                          os.path.join(directory, name)))
+    return sorted(found)
+
+
+def read_snapshot(filename, through=None):
+    """
+    Read a snapshot and replay its logs
+
+    Every log starts with a header line {"wal": generation, "base": n}:
+    its messages follow the first n saved messages. Messages that the
+    snapshot already holds (a log that was folded in just before a
+    crash) are skipped. A "reset" log replaces everything before it.
+
+    Args:
+        filename: Snapshot path
+        through: Only replay logs up to this generation
+
+    Returns:
+        List of message dicts
+
+    Raises:
+        FileNotFoundError: Neither the snapshot nor any log exists
+    """
+    while True:
+        logs = wal_files(filename)
+        try:
+            with open(filename, "r") as f:
+                messages = json.load(f)
+        except FileNotFoundError:
+            if not logs:
+                raise
+            messages = []
+        try:
+            for generation, path in logs:
+                if through is not None and generation > through:
+                    break
+                _replay_log(path, messages)
+            return messages
+        except FileNotFoundError:
+            # Another process folded the log into the snapshot while we
+            # were reading; start over from the new snapshot
+            continue
+
+
+def _replay_log(path, messages):
+    """Apply one log file to the messages read so far"""
+    records = read_journal(path)
+    header = next(records, None)
+    if header is None or "base" not in header:
+        return  # torn before the header was written
+    if header.get("reset"):
+        del messages[:]
+    skip = len(messages) - header["base"]
+    for record in records:
+        if skip > 0:
+            skip -= 1
+        else:
+            messages.append(record)
+
+
+def read_conversation(filename):
+    """
+    Read a journal, an archive, or a JSON snapshot plus its logs, as
+    message dicts
+    """
+    from archive import is_archive_file, read_archive
+
+    if is_archive_file(filename):
+        return read_archive(filename)
+    if is_journal_file(filename):
+        return read_journal(filename)
+    return read_snapshot(filename)
+
+
+class SnapshotLog:
+    """
+    Crash-safe JSON conversation file with cheap incremental saves
+
+    A full save writes every message to a new log file that is fsynced
+    and renamed into place; later saves append only the new messages to
+    a log and fsync it. When the current log passes compact_bytes, it is
+    closed and a background thread folds the snapshot and logs into a new
+    snapshot (temp file, fsync, rename) and deletes the folded logs, so
+    reading the file back never replays more than about compact_bytes.
+
+    Args:
+        filename: Snapshot path (a JSON array readable by any JSON tool
+            once compacted)
+        compact_bytes: Log size that triggers compaction
+        background: Compact on a background thread (False = inline)
+    """
+
+    def __init__(self, filename, compact_bytes=4 * 1024 * 1024,
+                 background=True):
+        self.filename = filename
+        self.compact_bytes = compact_bytes
+        self.background = background
+        # Messages of the caller's history that the files hold, or None
+        # when the files do not mirror it (next save must be full)
+        self.persisted = None
+        self._lock = threading.Lock()
+        self._wal = None
+        self._wal_generation = None
+        self._compactor = None
+
+    def read(self):
+        """Return every saved message (snapshot plus logs)"""
+        self.wait()
+        with self._lock:
+            return read_snapshot(self.filename)
+
+    def write_snapshot(self, records):
+        """Replace the saved conversation with records"""
+        records = list(records)
+        with self._lock:
+            self._close_wal()
+            generation = self._next_generation()
+            header = {"wal": generation, "base": 0, "reset": True}
+            atomic_write(self._wal_path(generation),
+                         [encode_record(header)] +
+                         [encode_record(record) for record in records])
+            self.persisted = len(records)
+        self._compact(generation)
+
+    def append(self, records):
+        """Add records after the ones already saved"""
+        if self.persisted is None:
+            raise ValueError("append() needs a snapshot written or read "
+                             "through this SnapshotLog first")
+        lines = [encode_record(record) for record in records]
+        if not lines:
+            return
+        with self._lock:
+            if self._wal is None:
+                generation = self._next_generation()
+                self._wal = open(self._wal_path(generation), "ab")
+                self._wal.write(encode_record(
+                    {"wal": generation, "base": self.persisted}))
+                self._wal_generation = generation
+            self._wal.write(b"".join(lines))
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self.persisted += len(lines)
+            full = self._wal.tell() >= self.compact_bytes
+            if full:
+                generation = self._wal_generation
+                self._close_wal()
+        if full:
+            self._compact(generation)
+
+    def compact(self):
+        """Fold every log into the snapshot now"""
+        with self._lock:
+            generation = self._wal_generation if self._wal else None
+            self._close_wal()
+        logs = wal_files(self.filename)
+        if generation is None and logs:
+            generation = logs[-1][0]
+        if generation is not None:
+            self.wait()
+            self._fold(generation)
+
+    def wait(self):
+        """Block until a running background compaction finishes"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self):
+        """Finish compaction and close the current log"""
+        self.wait()
+        with self._lock:
+            self._close_wal()
+
+    def _compact(self, generation):
+        # One compaction at a time, in generation order
+        self.wait()
+        if not self.background:
+            self._fold(generation)
+            return
+        self._compactor = threading.Thread(
+            target=self._fold, args=(generation,), daemon=True,
+            name="semire-compaction")
+        self._compactor.start()
+
+    def _fold(self, generation):
+        """Write snapshot + logs <= generation as the new snapshot"""
+        messages = read_snapshot(self.filename, through=generation)
+        atomic_write(self.filename, encode_snapshot(messages))
+        # Only now is it safe to drop the folded logs; if we crash before
+        # this, read_snapshot() skips what the snapshot already holds
+        for log_generation, path in wal_files(self.filename):
+            if log_generation <= generation:
+                os.remove(path)
+        fsync_directory(os.path.dirname(os.path.abspath(self.filename)))
+
+    def _close_wal(self):
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _next_generation(self):
+        logs = wal_files(self.filename)
+        return logs[-1][0] + 1 if logs else 1
+
+    def _wal_path(self, generation):
+        return f"{self.filename}{WAL_SUFFIX}{generation}"
@@ -0,0 +1,315 @@
+"""
+Local retrieval over past conversations (RAG) for SemireGPT
+
+RetrievalIndex keeps an inverted index with BM25 scoring over stored
+messages, plus an optional hashed bag-of-words vector index searched by
+brute force with NumPy. Messages can be added one at a time (SemireGPT
+does this from add_to_history) or in bulk from saved conversation files.
+
+On disk, an index directory holds:
+- documents.jsonl: one line per message, appended as messages are added
+- postings.pickle: snapshot of the inverted index written by save()
+- vectors.npy: snapshot of the vector index (if enabled)
+
+Opening a directory loads the snapshot and indexes any documents added
+after it, so an index that was not saved before exit is still complete.
+
+NumPy is optional: without it BM25 scoring runs in pure Python and the
+vector index is unavailable.
+"""
+
+import json
+import math
+import os
+import pickle
+import zlib
+from array import array
+from heapq import nlargest
+
+from intents import tokenize
+from persistence import read_conversation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DOCUMENTS_FILE = "documents.jsonl"
+POSTINGS_FILE = "postings.pickle"
+VECTORS_FILE = "vectors.npy"
+
+
+def term_counts(text):
+    """Return {term: count} for a piece of text"""
+    counts = {}
+    for term in tokenize(text):
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+class RetrievalIndex:
+    """
+    BM25 inverted index (and optional vector index) over messages
+
+    Args:
+        directory: Where the index lives (None = memory only)
+        vectors: Also keep a hashed bag-of-words vector index (NumPy)
+        dimensions: Size of the hashed vectors
+        k1, b: BM25 parameters
+    """
+
+    def __init__(self, directory=None, vectors=False, dimensions=256,
+                 k1=1.2, b=0.75):
+        if vectors and np is None:
+            raise ImportError("The vector index requires numpy")
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.dimensions = dimensions
+        self.use_vectors = vectors
+        self._postings = {}          # term -> (array of doc ids, array of tf)
+        self._lengths = array("I")   # tokens per document
+        self._total_length = 0
+        self._offsets = array("Q")   # document positions in documents.jsonl
+        self._memory_docs = []       # documents when there is no directory
+        self._vector_rows = []
+        self._vectors = None
+        self._numpy_postings = {}
+        self._documents = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+            self._documents = open(self._path(DOCUMENTS_FILE), "ab")
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, content, role="user", source=None):
+        """Index one message and return its document id"""
+        doc_id = len(self._lengths)
+        record = {"role": role, "content": content, "source": source}
+        if self._documents is not None:
+            self._offsets.append(self._documents.tell())
+            self._documents.write(json.dumps(record).encode("utf-8") + b"\n")
+        else:
+            self._memory_docs.append(record)
+        self._index(doc_id, content)
+        return doc_id
+
+    def add_conversation_file(self, filename):
+        """Index every message in a saved conversation (JSON or journal)"""
+        count = 0
+        for msg in read_conversation(filename):
+            self.add(msg["content"], msg["role"], source=filename)
+            count += 1
+        return count
+
+    def document(self, doc_id):
+        """Return the stored {"role", "content", "source"} for a document"""
+        if self._documents is None:
+            return self._memory_docs[doc_id]
+        self._documents.flush()
+        return self._read_document(doc_id)
+
+    def retrieve(self, query, k=5, method="bm25"):
+        """
+        Return the top-k documents for a query
+
+        Args:
+            query: Free text
+            k: Number of results
+            method: "bm25" or "vector"
+
+        Returns:
+            List of (score, doc_id, document) tuples, best first
+        """
+        if method == "vector":
+            scored = self._vector_search(query, k)
+        else:
+            scored = self._bm25_search(query, k)
+        return [(score, doc_id, self.document(doc_id))
+                for score, doc_id in scored]
+
+    def save(self):
+        """Write the postings (and vectors) snapshot to the directory"""
+        if not self.directory:
+            return
+        self._documents.flush()
+        snapshot = {
+            "documents": len(self._lengths),
+            "postings": self._postings,
+            "lengths": self._lengths,
+            "offsets": self._offsets,
+        }
+        temp_path = self._path(POSTINGS_FILE + ".tmp")
+        with open(temp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._path(POSTINGS_FILE))
+        if self.use_vectors:
+            temp_path = self._path("vectors.tmp.npy")
+            np.save(temp_path, self._vector_matrix())
+            os.replace(temp_path, self._path(VECTORS_FILE))
+
+    def close(self):
+        """Save the snapshot and close the documents file"""
+        if self._documents is not None:
+            self.save()
+            self._documents.close()
+            self._documents = None
+
+    # Indexing -------------------------------------------------------------
+
+    def _index(self, doc_id, content):
+        counts = term_counts(content)
+        for term, tf in counts.items():
+            entry = self._postings.get(term)
+            if entry is None:
+                entry = self._postings[term] = (array("I"), array("I"))
+            entry[0].append(doc_id)
+            entry[1].append(tf)
+            self._numpy_postings.pop(term, None)
+        length = sum(counts.values())
+        self._lengths.append(length)
+        self._total_length += length
+        if self.use_vectors:
+            self._vector_rows.append(self._embed(counts))
+
+    def _load(self):
+        postings_path = self._path(POSTINGS_FILE)
+        if os.path.exists(postings_path):
+            with open(postings_path, "rb") as f:
+                snapshot = pickle.load(f)
+            self._postings = snapshot["postings"]
+            self._lengths = snapshot["lengths"]
+            self._offsets = snapshot["offsets"]
+            self._total_length = sum(self._lengths)
+        if self.use_vectors:
+            vectors_path = self._path(VECTORS_FILE)
+            if os.path.exists(vectors_path):
+                self._vectors = np.load(vectors_path)[:len(self._lengths)]
+            start = 0 if self._vectors is None else len(self._vectors)
+            for doc_id in range(start, len(self._lengths)):
+                content = self._read_document(doc_id)["content"]
+                self._vector_rows.append(self._embed(term_counts(content)))
+        self._index_unsaved_documents()
+
+    def _index_unsaved_documents(self):
+        """Index documents appended after the last snapshot"""
+        documents_path = self._path(DOCUMENTS_FILE)
+        if not os.path.exists(documents_path):
+            return
+        with open(documents_path, "r+b") as f:
+            if self._offsets:
+                f.seek(self._offsets[-1])
+                f.readline()
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # end of file, or a torn last write
+                record = json.loads(line)
+                self._offsets.append(position)
+                self._index(len(self._lengths), record["content"])
+            # Drop a torn last write so new documents start on a fresh line
+            f.truncate(position)
+
+    def _read_document(self, doc_id):
+        with open(self._path(DOCUMENTS_FILE), "rb") as f:
+            f.seek(self._offsets[doc_id])
+            return json.loads(f.readline())
+
+    # Searching ------------------------------------------------------------
+
+    def _bm25_search(self, query, k):
+        count = len(self._lengths)
+        if not count:
+            return []
+        average_length = self._total_length / count
+        terms = set(tokenize(query))
+        if np is not None:
+            return self._bm25_numpy(terms, k, count, average_length)
+        k1, b = self.k1, self.b
+        lengths = self._lengths
+        scores = {}
+        for term in terms:
+            entry = self._postings.get(term)
+            if entry is None:
+                continue
+            doc_ids, tfs = entry
+            idf = self._idf(len(doc_ids), count)
+            for doc_id, tf in zip(doc_ids, tfs):
+                norm = k1 * (1 - b + b * lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + \
+                    idf * tf * (k1 + 1) / (tf + norm)
+        best = nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, doc_id) for doc_id, score in best]
+
+    def _bm25_numpy(self, terms, k, count, average_length):
+        k1, b = self.k1, self.b
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        scores = np.zeros(count, dtype=np.float32)
+        for term in terms:
+            if term not in self._postings:
+                continue
+            doc_ids, tfs = self._numpy_entry(term)
+            idf = self._idf(len(doc_ids), count)
+            norms = k1 * (1 - b + b * lengths[doc_ids] / average_length)
+            # Each document appears once per term, so fancy-index += is safe
+            scores[doc_ids] += idf * tfs * (k1 + 1) / (tfs + norms)
+        return self._top_k(scores, k)
+
+    def _numpy_entry(self, term):
+        """Cached NumPy copies of a term's postings"""
+        entry = self._numpy_postings.get(term)
+        if entry is None:
+            doc_ids, tfs = self._postings[term]
+            entry = (np.frombuffer(doc_ids, dtype=np.uint32).astype(np.intp),
+                     np.frombuffer(tfs, dtype=np.uint32).astype(np.float32))
+            self._numpy_postings[term] = entry
+        return entry
+
+    def _idf(self, document_frequency, count):
+        return math.log(1 + (count - document_frequency + 0.5) /
+                        (document_frequency + 0.5))
+
+    def _embed(self, counts):
+        """Hashed, L2-normalized bag-of-words vector"""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term, tf in counts.items():
+            bucket = zlib.crc32(term.encode("utf-8"))
+            sign = 1.0 if bucket & 1 else -1.0
+            vector[(bucket >> 1) % self.dimensions] += sign * tf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _vector_matrix(self):
+        if self._vector_rows:
+            rows = np.vstack(self._vector_rows)
+            if self._vectors is None:
+                self._vectors = rows
+            else:
+                self._vectors = np.vstack([self._vectors, rows])
+            self._vector_rows = []
+        if self._vectors is None:
+            self._vectors = np.zeros((0, self.dimensions), dtype=np.float32)
+        return self._vectors
+
+    def _vector_search(self, query, k):
+        if not self.use_vectors:
+            raise ValueError("This index was created without vectors=True")
+        matrix = self._vector_matrix()
+        if not len(matrix):
+            return []
+        return self._top_k(matrix @ self._embed(term_counts(query)), k)
+
+    @staticmethod
+    def _top_k(scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(i)) for i in top if scores[i] > 0]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
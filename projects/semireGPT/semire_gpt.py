@@ -12,32 +12,120 @@ Current status: API call to ChatGPT (to be enhanced)
 """
 
 import os
-import json
-from datetime import datetime
+import sys
+import time
+
+# Optional subsystems (backends, cache, worker pools, asyncio, argparse,
+# the server) are imported where they are first used, so that starting a
+# chat only pays for what it needs; see --profile-startup.
+from admission import default_admission
+from archive import ARCHIVE_SUFFIX, is_archive_file
+from context import ContextBuilder
+from history_store import HistoryStore, parse_timestamp
+from intents import default_matcher
+from persistence import (ConversationJournal, LazyHistory, SnapshotLog,
+                         is_journal_file, read_conversation, read_journal)
+from tracing import default_tracer
 
 
 class SemireGPT:
     """Main class for SemireGPT AI assistant"""
     
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, history_store=None, max_in_memory=1000,
+                 journal_path=None, sync_every=None, backend=None,
+                 session_id=None, cache=None, context_budget=3000,
+                 retriever=None, retrieve_k=3, tracer=None,
+                 compact_bytes=4 * 1024 * 1024, dedup=False, admission=None):
         """
         Initialize SemireGPT
         
         Args:
             api_key: API key for the AI service (optional)
+            history_store: Object used to store the conversation
+                (defaults to a HistoryStore)
+            max_in_memory: Messages kept in memory before older ones
+                spill to disk (ignored when history_store is given)
+            journal_path: Enable journal mode - every message is appended
+                to this JSONL file as it is added
+            sync_every: In journal mode, fsync after this many messages
+                (None = only when saving or closing)
+            backend: Object with a generate(message, context) method
+                used instead of the built-in rule-based responses
+                (an HTTPBackend is created if SEMIRE_BACKEND_URL is set)
+            session_id: Identifier for this conversation (random if
+                omitted); requests are ordered per session
+            cache: ResponseCache consulted before calling the backend
+            context_budget: Token budget for the system prompt plus the
+                recent turns sent to the backend
+            retriever: RetrievalIndex that every message is added to and
+                that is searched for relevant past messages
+            retrieve_k: Past messages retrieved per request
+            tracer: Tracer that times each stage of a request (defaults
+                to the process tracer, which is disabled unless
+                SEMIRE_TRACE is set)
+            compact_bytes: Size of the save log after which a JSON save
+                file is compacted into a fresh snapshot
+            dedup: In journal mode, store repeated message bodies once
+                in a blobs.db shared by every journal in the directory
+            admission: AdmissionController that rate-limits and queues
+                requests (defaults to the process controller, which
+                admits everything unless SEMIRE_RATE etc. are set)
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self.conversation_history = []
+        if history_store is None:
+            history_store = HistoryStore(max_in_memory=max_in_memory)
+        self.conversation_history = history_store
         self.system_prompt = "You are SemireGPT, a helpful AI assistant."
+        self.context = ContextBuilder(self.system_prompt, context_budget)
+        self._intents = None
+        if backend is None and os.getenv("SEMIRE_BACKEND_URL"):
+            from backends import HTTPBackend
+            backend = HTTPBackend(os.getenv("SEMIRE_BACKEND_URL"),
+                                  api_key=self.api_key,
+                                  system_prompt=self.system_prompt)
+        self.backend = backend
+        self.cache = cache
+        self.retriever = retriever
+        self.retrieve_k = retrieve_k
+        self.session_id = session_id or os.urandom(16).hex()
+        self.tracer = tracer or default_tracer()
+        self.admission = admission or default_admission()
+        self._async_lock = None
+        self.compact_bytes = compact_bytes
+        self._snapshots = {}
+        self.journal = None
+        if journal_path:
+            blobs = None
+            if dedup:
+                from content_store import blob_store_for
+                blobs = blob_store_for(journal_path)
+            self.journal = ConversationJournal(journal_path,
+                                               sync_every=sync_every,
+                                               blobs=blobs)
+    
+    @property
+    def intents(self):
+        """Compiled rule table (loaded on first use)"""
+        if self._intents is None:
+            self._intents = default_matcher()
+        return self._intents
+    
+    @intents.setter
+    def intents(self, matcher):
+        self._intents = matcher
     
     def add_to_history(self, role, content):
         """Add a message to conversation history"""
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        }
-        self.conversation_history.append(message)
+        timestamp = time.time()
+        with self.tracer.span("history"):
+            self.conversation_history.append(role, content, timestamp)
+            self.context.add(role, content)
+        if self.retriever is not None:
+            with self.tracer.span("retrieval_index"):
+                self.retriever.add(content, role, source=self.session_id)
+        if self.journal is not None:
+            with self.tracer.span("journal"):
+                self.journal.append(role, content, timestamp)
     
     def get_response(self, user_message):
         """
@@ -48,21 +136,270 @@ class SemireGPT:
             
         Returns:
             AI response string
+            
+        Raises:
+            Rejected: The admission controller turned the request away
+                (rate limit, full queue or deadline)
+        """
+        with self.admission.admit(self.session_id), \
+                self.tracer.span("get_response"):
+            # Recent turns that fit the token budget (before this message),
+            # plus relevant past messages if a retriever is configured
+            with self.tracer.span("context"):
+                context = self._backend_context(user_message)
+            
+            # Add user message to history
+            self.add_to_history("user", user_message)
+            
+            # TODO: Replace this with your custom AI implementation
+            # For now, this is a placeholder that shows the structure
+            
+            # Simulated response (replace with actual AI call)
+            ai_response = self._generate(user_message, context)
+            
+            # Add AI response to history
+            self.add_to_history("assistant", ai_response)
+        
+        return ai_response
+    
+    def get_responses(self, messages, workers=4, queue_size=64):
         """
-        # Add user message to history
-        self.add_to_history("user", user_message)
+        Answer many independent messages in parallel (bulk scoring)
         
-        # TODO: Replace this with your custom AI implementation
-        # For now, this is a placeholder that shows the structure
+        History is not touched. Replies come back in input order.
         
-        # Simulated response (replace with actual AI call)
-        ai_response = self._simulate_response(user_message)
+        Args:
+            messages: Iterable of messages, or of (session_id, message)
+                pairs; messages of one session are answered in order
+            workers: Number of worker threads
+            queue_size: Maximum waiting messages per worker
+            
+        Returns:
+            List of AI response strings
+        """
+        return list(self.iter_responses(messages, workers, queue_size))
+    
+    def iter_responses(self, messages, workers=4, queue_size=64):
+        """
+        Like get_responses(), but yields replies as they complete
+        
+        At most workers * queue_size messages are in flight, so a replay
+        of millions of logged prompts runs in constant memory.
+        """
+        from collections import deque
+        from dispatch import WorkerPool
+        
+        pending = deque()
+        max_pending = workers * queue_size
+        with WorkerPool(workers, queue_size) as pool:
+            for position, item in enumerate(messages):
+                if isinstance(item, tuple):
+                    key, message = item
+                else:
+                    key, message = position, item
+                pending.append(pool.submit(key, self._generate, message))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    async def aget_response(self, user_message, pool=None):
+        """
+        Async version of get_response()
         
-        # Add AI response to history
-        self.add_to_history("assistant", ai_response)
+        The backend call runs on a worker thread, so many sessions can be
+        served from one event loop. Calls on the same instance are
+        answered and recorded in the order they were made.
         
+        Args:
+            user_message: The user's input message
+            pool: WorkerPool to run on (defaults to a shared pool)
+        """
+        import asyncio
+        from dispatch import default_pool
+        
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        pool = pool or default_pool()
+        async with self._async_lock, self.admission.admit(self.session_id):
+            with self.tracer.span("get_response"):
+                with self.tracer.span("context"):
+                    context = self._backend_context(user_message)
+                self.add_to_history("user", user_message)
+                ai_response = await pool.asubmit(
+                    self.session_id, self._generate, user_message, context)
+                self.add_to_history("assistant", ai_response)
         return ai_response
     
+    def stream_response(self, user_message):
+        """
+        Get AI response to user message, yielding chunks as they arrive
+        
+        The assembled reply is added to history once the stream ends.
+        
+        Args:
+            user_message: The user's input message
+            
+        Yields:
+            Pieces of the AI response string
+        """
+        def turn():
+            with self.tracer.span("context"):
+                context = self._backend_context(user_message)
+            self.add_to_history("user", user_message)
+            chunks = []
+            for chunk in self._stream(user_message, context):
+                chunks.append(chunk)
+                yield chunk
+            self.add_to_history("assistant", "".join(chunks))
+        
+        with self.admission.admit(self.session_id):
+            # Like get_response's span, but without the time the caller
+            # spends on each chunk
+            yield from self.tracer.iterate("get_response", turn())
+    
+    async def astream_response(self, user_message, pool=None):
+        """
+        Async iterator version of stream_response()
+        
+        The backend stream is consumed on a worker thread and handed to
+        the event loop chunk by chunk.
+        """
+        import asyncio
+        from dispatch import default_pool
+        
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        pool = pool or default_pool()
+        loop = asyncio.get_running_loop()
+        chunks_queue = asyncio.Queue()
+        done = object()
+        
+        def pump(context):
+            try:
+                for chunk in self._stream(user_message, context):
+                    loop.call_soon_threadsafe(chunks_queue.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(chunks_queue.put_nowait, done)
+            return time.perf_counter_ns()
+        
+        async with self._async_lock, self.admission.admit(self.session_id):
+            start = time.perf_counter_ns()
+            with self.tracer.span("context"):
+                context = self._backend_context(user_message)
+            self.add_to_history("user", user_message)
+            task = asyncio.ensure_future(
+                pool.asubmit(self.session_id, pump, context))
+            chunks = []
+            while True:
+                chunk = await chunks_queue.get()
+                if chunk is done:
+                    break
+                chunks.append(chunk)
+                yield chunk
+            finished = await task  # re-raises backend errors
+            self.add_to_history("assistant", "".join(chunks))
+            # The stream runs ahead of the caller: time it to its last chunk
+            self.tracer.record("get_response", finished - start)
+    
+    def retrieve(self, query, k=None):
+        """
+        Find past messages relevant to a query
+        
+        Args:
+            query: Text to search for
+            k: Number of results (defaults to retrieve_k)
+            
+        Returns:
+            List of (score, doc_id, document) tuples, best first
+        """
+        if self.retriever is None:
+            return []
+        return self.retriever.retrieve(query, k or self.retrieve_k)
+    
+    def stats(self):
+        """
+        Return performance counters for this session
+        
+        Returns:
+            {"latency": per-stage p50/p99/p999 from the tracer (empty
+            unless tracing is enabled), "cache": cache counters if a
+            cache is configured, "content": the shared content table,
+            "admission": rejection/timeout counters if requests are
+            limited}
+        """
+        stats = {"latency": self.tracer.stats()}
+        if self.admission.enabled:
+            stats["admission"] = self.admission.stats()
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        content_store = getattr(self.conversation_history, "content_store",
+                                None)
+        if content_store is not None:
+            stats["content"] = content_store.stats()
+        return stats
+    
+    def _backend_context(self, user_message):
+        """Return the context to send with the next message"""
+        if self.backend is None or not getattr(self.backend, "uses_context",
+                                               True):
+            return ()
+        self.context.system_prompt = self.system_prompt
+        context = self.context.messages()
+        retrieved = self.retrieve(user_message)
+        if retrieved:
+            notes = "\n".join(f"- {doc['role']}: {doc['content']}"
+                              for _, _, doc in retrieved)
+            context.insert(0, {"role": "system",
+                               "content": f"Relevant past messages:\n{notes}"})
+        return context
+    
+    def _generate(self, message, context=()):
+        """Ask the cache, then the backend (or the rule-based fallback)"""
+        if self.cache is not None:
+            from cache import make_key
+            with self.tracer.span("cache"):
+                key = make_key(message, self.system_prompt, context)
+                cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        with self.tracer.span("generate"):
+            if self.backend is not None:
+                response = self.backend.generate(message, list(context))
+            else:
+                response = self._simulate_response(message)
+        if self.cache is not None:
+            with self.tracer.span("cache"):
+                self.cache.put(key, response)
+        return response
+    
+    def _stream(self, message, context=()):
+        """Streaming counterpart of _generate()"""
+        from backends import split_chunks
+        
+        if self.cache is not None:
+            from cache import make_key
+            with self.tracer.span("cache"):
+                key = make_key(message, self.system_prompt, context)
+                cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        if self.backend is not None:
+            chunks = []
+            for chunk in self.tracer.iterate(
+                    "generate", self.backend.stream(message, list(context))):
+                chunks.append(chunk)
+                yield chunk
+            response = "".join(chunks)
+        else:
+            with self.tracer.span("generate"):
+                response = self._simulate_response(message)
+            yield from split_chunks(response)
+        if self.cache is not None:
+            with self.tracer.span("cache"):
+                self.cache.put(key, response)
+    
     def _simulate_response(self, message):
         """
         Simulate an AI response (placeholder for actual implementation)
@@ -73,61 +410,325 @@ class SemireGPT:
         - RAG (Retrieval-Augmented Generation)
         - Your own AI architecture
         """
-        # Simple rule-based responses for demonstration
-        message_lower = message.lower()
-        
-        if "hello" in message_lower or "hi" in message_lower:
-            return "Hello! I'm SemireGPT. How can I help you today?"
-        elif "how are you" in message_lower:
-            return "I'm functioning well, thank you! How can I assist you?"
-        elif "what can you do" in message_lower or "help" in message_lower:
-            return ("I'm SemireGPT, currently in development. "
-                   "I can have basic conversations, but I'm being enhanced "
-                   "to become a fully custom AI assistant!")
-        elif "name" in message_lower:
-            return "My name is SemireGPT - a custom AI being developed!"
-        else:
-            return (f"I heard you say: '{message}'. "
-                   f"I'm still learning and improving my responses!")
+        # Simple rule-based responses for demonstration (see intents.py)
+        rule = self.intents.match(message)
+        if rule is not None:
+            return rule.response
+        return (f"I heard you say: '{message}'. "
+               f"I'm still learning and improving my responses!")
     
-    def save_conversation(self, filename="conversation_history.json"):
-        """Save conversation history to a file"""
-        with open(filename, "w") as f:
-            json.dump(self.conversation_history, f, indent=2)
+    def save_conversation(self, filename=None):
+        """
+        Save conversation history to a file
+        
+        In journal mode, saving to the journal (the default) only flushes
+        and fsyncs the lines already written. Any other filename gets a
+        JSON export: the first save writes every message, later saves to
+        the same file only append the new ones to its log (see
+        SnapshotLog), and a crash never leaves a half-written file.
+        A filename ending in .sgz is written as a compressed archive (see
+        archive.py).
+        """
+        if self.journal is not None and filename in (None,
+                                                     self.journal.filename):
+            self.journal.flush(sync=True)
+            print(f"Conversation saved to {self.journal.filename}")
+            return
+        filename = filename or "conversation_history.json"
+        if filename.endswith(ARCHIVE_SUFFIX):
+            from archive import write_archive
+            with self.tracer.span("save"):
+                write_archive(filename, self.conversation_history)
+            print(f"Conversation archived to {filename}")
+            return
+        log = self._snapshot_log(filename)
+        history = self.conversation_history
+        with self.tracer.span("save"):
+            if log.persisted is None or log.persisted > len(history):
+                log.write_snapshot(msg.to_dict() for msg in history)
+            else:
+                log.append(msg.to_dict()
+                           for msg in history[log.persisted:])
         print(f"Conversation saved to {filename}")
     
-    def load_conversation(self, filename="conversation_history.json"):
-        """Load conversation history from a file"""
+    def load_conversation(self, filename=None, lazy=False):
+        """
+        Load conversation history from a file
+        
+        Accepts JSON exports, JSONL journals and compressed archives;
+        journals and archives are streamed.
+        
+        Args:
+            filename: File to load (defaults to the journal, if any)
+            lazy: For journals, memory-map the file through its offset
+                index instead of reading it (for archives, read only the
+                block index), so messages are only decoded when accessed
+        """
+        if filename is None:
+            if self.journal is not None:
+                filename = self.journal.filename
+            else:
+                filename = "conversation_history.json"
+        own_journal = self.journal is not None and \
+            filename == self.journal.filename
+        if own_journal:
+            # Reading our own journal: buffered messages must be on disk
+            self.journal.flush()
         try:
-            with open(filename, "r") as f:
-                self.conversation_history = json.load(f)
-            print(f"Conversation loaded from {filename}")
+            archived = is_archive_file(filename)
+            if (lazy and (self.journal is None or own_journal) and
+                    hasattr(self.conversation_history, "set_base") and
+                    (archived or is_journal_file(filename))):
+                if archived:
+                    from archive import ArchiveReader
+                    base = ArchiveReader(filename)
+                else:
+                    base = LazyHistory(filename)
+                self.conversation_history.set_base(base)
+                self.context.rebuild(self.conversation_history)
+                print(f"Conversation loaded from {filename}")
+                return
+            if archived:
+                messages = read_conversation(filename)
+            elif is_journal_file(filename):
+                messages = read_journal(filename)
+            else:
+                messages = self._snapshot_log(filename).read()
         except FileNotFoundError:
             print(f"No conversation file found at {filename}")
+            return
+        self.conversation_history.clear()
+        if self.journal is None or own_journal:
+            self.conversation_history.extend(messages)
+        else:
+            # Keep the journal in step with what was loaded
+            self.journal.truncate()
+            for msg in messages:
+                timestamp = parse_timestamp(msg.get("timestamp"))
+                self.conversation_history.append(msg["role"], msg["content"],
+                                                 timestamp)
+                self.journal.append(msg["role"], msg["content"], timestamp)
+        self._forget_saves()
+        if filename in self._snapshots:
+            # The history now mirrors this file, so saves can append
+            self._snapshots[filename].persisted = \
+                len(self.conversation_history)
+        self.context.rebuild(self.conversation_history)
+        print(f"Conversation loaded from {filename}")
     
     def clear_history(self):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self.context.clear()
+        self._forget_saves()
+        if self.journal is not None:
+            self.journal.truncate()
         print("Conversation history cleared")
     
-    def display_history(self):
-        """Display the conversation history"""
-        print("\n=== Conversation History ===")
-        for msg in self.conversation_history:
-            role = msg["role"].capitalize()
-            content = msg["content"]
-            print(f"\n{role}: {content}")
+    def close(self):
+        """Flush the journal and release everything the session holds open"""
+        if self.backend is not None:
+            self.backend.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.retriever is not None:
+            self.retriever.close()
+        for log in self._snapshots.values():
+            log.close()
+        if self.journal is not None:
+            self.journal.close()
+        if hasattr(self.conversation_history, "close"):
+            self.conversation_history.close()
+    
+    def _snapshot_log(self, filename):
+        """Return the SnapshotLog that saves to filename"""
+        log = self._snapshots.get(filename)
+        if log is None:
+            log = SnapshotLog(filename, compact_bytes=self.compact_bytes)
+            self._snapshots[filename] = log
+        return log
+    
+    def _forget_saves(self):
+        """The history was replaced: the next save to any file is full"""
+        for log in self._snapshots.values():
+            log.persisted = None
+    
+    def display_history(self, page=None, page_size=20):
+        """
+        Display the conversation history
+        
+        Messages are formatted one page at a time, so a long history is
+        never rendered into a single string.
+        
+        Args:
+            page: Show only this page (1 = oldest, -1 = newest)
+            page_size: Messages per page
+        """
+        history = self.conversation_history
+        pages = max((len(history) + page_size - 1) // page_size, 1)
+        if page is None:
+            selected = history.pages(page_size) if hasattr(history, "pages") \
+                else self._pages(history, page_size)
+            title = "=== Conversation History ==="
+        else:
+            number = page if page > 0 else pages + 1 + page
+            if not 1 <= number <= pages:
+                print(f"No page {page} (history has {pages} pages)")
+                return
+            start = (number - 1) * page_size
+            selected = [history[start:start + page_size]]
+            title = f"=== Conversation History (page {number}/{pages}) ==="
+        print("\n" + title)
+        for messages in selected:
+            print("".join(f"\n{msg.role.capitalize()}: {msg.content}\n"
+                          for msg in messages), end="")
         print("\n" + "="*30)
+    
+    @staticmethod
+    def _pages(history, page_size):
+        """Split any iterable history into lists of page_size messages"""
+        page = []
+        for msg in history:
+            page.append(msg)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+def parse_args(argv=None):
+    """Parse command-line options"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="SemireGPT AI assistant")
+    parser.add_argument("--serve", action="store_true",
+                        help="run the multi-session server instead of a chat")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--unix", metavar="PATH",
+                        help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="server worker processes (sessions are "
+                             "sharded across them)")
+    parser.add_argument("--max-sessions", type=int,
+                        help="in-memory sessions per worker process "
+                             "(default and cap: what the open-file "
+                             "limit allows)")
+    parser.add_argument("--idle-timeout", type=float, default=300.0,
+                        help="seconds before an idle session is evicted")
+    parser.add_argument("--data-dir", default="sessions",
+                        help="directory for server session journals")
+    parser.add_argument("--dedup", action="store_true",
+                        help="store repeated message bodies once in the "
+                             "server data directory (blobs.db)")
+    parser.add_argument("--rate", type=float,
+                        help="requests per second across all sessions")
+    parser.add_argument("--session-rate", type=float,
+                        help="requests per second per session")
+    parser.add_argument("--max-concurrent", type=int,
+                        help="requests in progress at once (per server "
+                             "worker process); more wait in a queue")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="requests allowed to wait; more are rejected")
+    parser.add_argument("--deadline", type=float,
+                        help="seconds a request may wait before it is "
+                             "rejected")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="time each request stage and dump latency "
+                             "percentiles to FILE as JSON")
+    parser.add_argument("--trace-interval", type=float, default=60.0,
+                        help="seconds between trace dumps")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report an import-time breakdown of start-up "
+                             "and exit")
+    return parser.parse_args(argv)
 
 
-def main():
+def profile_startup(limit=15):
+    """
+    Report where start-up time goes
+    
+    Runs a fresh interpreter with -X importtime that imports this module
+    and creates a SemireGPT (everything that happens before the first
+    prompt), then prints the slowest imports and the total time.
+    """
+    import subprocess
+    
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    code = ("import time; start = time.perf_counter(); import semire_gpt; "
+            "semire_gpt.SemireGPT(); "
+            "print((time.perf_counter() - start) * 1000)")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=project_dir, capture_output=True, text=True,
+                            check=True)
+    total_ms = (time.perf_counter() - start) * 1000
+    
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not cumulative_us.strip().isdigit():
+            continue  # column headings
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        module = name.strip()
+        own = os.path.exists(os.path.join(project_dir, module + ".py"))
+        if depth == 0 or own:
+            imports.append((int(cumulative_us) / 1000, int(self_us) / 1000,
+                            module, own))
+    imports.sort(reverse=True)
+    
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative_ms, self_ms, module, own in imports[:limit]:
+        marker = "  (semireGPT)" if own else ""
+        print(f"{cumulative_ms:>14.2f} {self_ms:>8.2f}  {module}{marker}")
+    print(f"\nImport semire_gpt + SemireGPT(): "
+          f"{float(result.stdout.strip()):.1f} ms")
+    print(f"Process start to first prompt:  {total_ms:.1f} ms "
+          f"(includes interpreter start-up)")
+
+
+def main(argv=None):
     """Main function to run SemireGPT in interactive mode"""
+    args = parse_args(argv)
+    if args.profile_startup:
+        profile_startup()
+        return
+    if args.trace:
+        # Picked up by default_tracer() here and in server workers
+        os.environ["SEMIRE_TRACE"] = "1"
+        # Each server worker process writes its own file
+        os.environ["SEMIRE_TRACE_DUMP"] = args.trace + \
+            (".{pid}" if args.serve else "")
+        os.environ["SEMIRE_TRACE_INTERVAL"] = str(args.trace_interval)
+    # Picked up by default_admission(), like the trace settings
+    limits = {"SEMIRE_RATE": args.rate,
+              "SEMIRE_SESSION_RATE": args.session_rate,
+              "SEMIRE_MAX_CONCURRENT": args.max_concurrent,
+              "SEMIRE_DEADLINE": args.deadline}
+    if args.rate and args.serve:
+        # Every worker process has its own bucket; split the budget
+        limits["SEMIRE_RATE"] = args.rate / args.workers
+    for name, value in limits.items():
+        if value is not None:
+            os.environ[name] = str(value)
+    os.environ["SEMIRE_MAX_QUEUE"] = str(args.max_queue)
+    if args.serve:
+        from server import run_server
+        run_server(args.host, args.port, args.unix, data_dir=args.data_dir,
+                   workers=args.workers, max_sessions=args.max_sessions,
+                   idle_timeout=args.idle_timeout,
+                   session_options={"dedup": args.dedup})
+        return
+    
     print("="*50)
     print("Welcome to SemireGPT!")
     print("="*50)
     print("\nA custom AI assistant in development")
     print("Type 'quit' to exit")
-    print("Type 'history' to see conversation history")
+    print("Type 'history' to see conversation history "
+          "('history -1' for the newest page)")
     print("Type 'clear' to clear history")
     print("Type 'save' to save conversation")
     print("="*50)
@@ -144,10 +745,17 @@ def main():
             # Handle commands
             if user_input.lower() == "quit":
                 print("\nThank you for using SemireGPT! Goodbye!")
+                gpt.close()
                 break
             elif user_input.lower() == "history":
                 gpt.display_history()
                 continue
+            elif user_input.lower().startswith("history "):
+                try:
+                    gpt.display_history(page=int(user_input.split()[1]))
+                except ValueError:
+                    print("Usage: history [page]  (-1 = newest page)")
+                continue
             elif user_input.lower() == "clear":
                 gpt.clear_history()
                 continue
@@ -157,12 +765,15 @@ def main():
             elif not user_input:
                 continue
             
-            # Get and display AI response
-            response = gpt.get_response(user_input)
-            print(f"\nSemireGPT: {response}")
+            # Display the AI response as it is generated
+            print("\nSemireGPT: ", end="", flush=True)
+            for chunk in gpt.stream_response(user_input):
+                print(chunk, end="", flush=True)
+            print()
             
         except KeyboardInterrupt:
             print("\n\nInterrupted. Goodbye!")
+            gpt.close()
             break
         except Exception as e:
             print(f"\nError: {e}")
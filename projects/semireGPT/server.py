@@ -0,0 +1,379 @@
+"""
+Multi-session server mode for SemireGPT
+
+An asyncio front end accepts JSON-lines requests over TCP or a Unix socket
+and forwards each one to a worker process chosen by session id, so all of
+a session's requests land on the same process and are answered in order.
+Each worker keeps its active sessions in memory and evicts idle ones to
+their journal on disk; the next request for an evicted session reloads it
+lazily from that journal.
+
+Protocol (one JSON object per line, in both directions):
+    {"id": 1, "session": "alice", "message": "hello"}
+    {"id": 1, "session": "alice", "response": "Hello! ..."}
+
+Instead of "message", a request may carry "command": "history" or
+"clear". Errors come back as {"id": ..., "error": "..."}; requests
+turned away by rate limiting or admission control also carry
+"rejected": "rate_limited", "overloaded" or "deadline".
+
+Start it with:
+    python semire_gpt.py --serve --port 8700 --workers 4
+"""
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from admission import Rejected
+from dispatch import WorkerPool, shard_for
+from semire_gpt import SemireGPT
+
+SESSION_ID_RE = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+# Descriptors one in-memory session may hold: journal and index, the
+# file and mmap of a rehydrated history, and a spill file
+FDS_PER_SESSION = 5
+# Left for sockets, pipes, sqlite files and the like
+RESERVED_FDS = 64
+
+
+def raise_fd_limit():
+    """
+    Raise this process's soft open-file limit to the hard limit
+
+    Returns:
+        The soft limit now in force (None where there is no such limit)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 1 << 16 if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+            soft = wanted
+        except (ValueError, OSError):
+            pass
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+def session_capacity():
+    """Sessions a worker can keep in memory within its open-file limit"""
+    limit = raise_fd_limit()
+    if limit is None:
+        return 1000
+    return max(1, (limit - RESERVED_FDS) // FDS_PER_SESSION)
+
+
+class SessionTable:
+    """
+    Sessions hosted by one worker process, with LRU/idle eviction to disk
+
+    Args:
+        data_dir: Directory holding one journal per session
+        max_sessions: Sessions kept in memory before the least recently
+            used one is evicted (None = as many as the open-file limit
+            allows; larger values are capped to it, see
+            session_capacity)
+        idle_timeout: Seconds without requests before a session is evicted
+        session_options: Extra keyword arguments for SemireGPT
+    """
+
+    def __init__(self, data_dir, max_sessions=None, idle_timeout=300.0,
+                 session_options=None):
+        self.data_dir = data_dir
+        # Every session keeps files open; past the limit, opening the
+        # next one fails with EMFILE
+        capacity = session_capacity()
+        self.max_sessions = capacity if max_sessions is None \
+            else min(max_sessions, capacity)
+        self.idle_timeout = idle_timeout
+        self.session_options = session_options or {}
+        self._sessions = OrderedDict()   # id -> [SemireGPT, last_used, busy]
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.rehydrations = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def acquire(self, session_id):
+        """Return the session's SemireGPT, loading it if needed"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = [self._open(session_id), 0.0, 0]
+                self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            entry[1] = time.monotonic()
+            entry[2] += 1
+            return entry[0]
+
+    def release(self, session_id):
+        """Mark one request for the session as finished"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[2] -= 1
+                entry[1] = time.monotonic()
+            self._evict()
+
+    def evict_idle(self):
+        """Evict sessions that have been idle longer than idle_timeout"""
+        with self._lock:
+            self._evict()
+
+    def close(self):
+        """Flush and close every session"""
+        with self._lock:
+            for gpt, _, _ in self._sessions.values():
+                gpt.close()
+            self._sessions.clear()
+
+    def _open(self, session_id):
+        journal = os.path.join(self.data_dir, f"{session_id}.jsonl")
+        existed = os.path.exists(journal)
+        gpt = SemireGPT(session_id=session_id, journal_path=journal,
+                        **self.session_options)
+        if existed:
+            gpt.load_conversation(lazy=True)
+            self.rehydrations += 1
+        return gpt
+
+    def _evict(self):
+        now = time.monotonic()
+        for session_id in list(self._sessions):
+            gpt, last_used, busy = self._sessions[session_id]
+            over_limit = len(self._sessions) > self.max_sessions
+            idle = now - last_used > self.idle_timeout
+            if busy:
+                continue
+            if not (over_limit or idle):
+                # Entries are in LRU order, so the rest are more recent
+                break
+            del self._sessions[session_id]
+            gpt.close()
+            self.evictions += 1
+
+
+def _handle(table, request):
+    """Run one request against a session and build the reply"""
+    session_id = request["session"]
+    reply = {"id": request.get("id"), "session": session_id}
+    acquired = False
+    try:
+        # Inside the try: a session that fails to open still gets a reply
+        gpt = table.acquire(session_id)
+        acquired = True
+        command = request.get("command")
+        if command == "history":
+            reply["history"] = [msg.to_dict()
+                                for msg in gpt.conversation_history]
+        elif command == "clear":
+            gpt.clear_history()
+            reply["response"] = "cleared"
+        elif "message" in request:
+            reply["response"] = gpt.get_response(str(request["message"]))
+        else:
+            reply["error"] = "expected 'message' or 'command'"
+    except Rejected as e:
+        # Turned away before any work was done; the client may retry
+        reply["error"] = str(e)
+        reply["rejected"] = e.reason
+    except Exception as e:
+        reply["error"] = str(e)
+    finally:
+        if acquired:
+            table.release(session_id)
+    return reply
+
+
+def worker_main(conn, data_dir, threads, options):
+    """
+    Body of a shard worker process
+
+    Requests arrive as (token, request) over the pipe; replies go back as
+    (token, reply). A WorkerPool keyed by session id keeps each session's
+    requests in order while different sessions run concurrently.
+    """
+    # SemireGPT reports saves/loads with print(); keep workers quiet
+    sys.stdout = open(os.devnull, "w")
+    table = SessionTable(data_dir, **options)
+    send_lock = threading.Lock()
+
+    def run(token, request):
+        reply = _handle(table, request)
+        with send_lock:
+            conn.send((token, reply))
+
+    with WorkerPool(workers=threads) as pool:
+        while True:
+            if not conn.poll(1.0):
+                table.evict_idle()
+                continue
+            try:
+                item = conn.recv()
+            except EOFError:
+                break
+            if item is None:
+                break
+            token, request = item
+            pool.submit(request["session"], run, token, request)
+    table.close()
+
+
+class ShardedServer:
+    """
+    asyncio front end that routes JSON-lines requests to worker processes
+
+    Args:
+        data_dir: Directory for session journals
+        workers: Number of worker processes (shards)
+        threads: Worker threads per process
+        max_sessions, idle_timeout: Passed to each worker's SessionTable
+        session_options: Extra keyword arguments for SemireGPT
+    """
+
+    def __init__(self, data_dir="sessions", workers=4, threads=8,
+                 max_sessions=None, idle_timeout=300.0,
+                 session_options=None):
+        self.data_dir = data_dir
+        self.workers = workers
+        self.threads = threads
+        self.table_options = {"max_sessions": max_sessions,
+                              "idle_timeout": idle_timeout,
+                              "session_options": session_options}
+        self._pipes = []
+        self._processes = []
+        self._pending = {}
+        self._tokens = itertools.count()
+        self._loop = None
+
+    def start_workers(self):
+        """Start the shard processes (call before serving)"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        for _ in range(self.workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=worker_main,
+                args=(child, self.data_dir, self.threads, self.table_options),
+                daemon=True)
+            process.start()
+            child.close()
+            self._pipes.append(parent)
+            self._processes.append(process)
+
+    def stop_workers(self):
+        """Ask the workers to flush their sessions and exit"""
+        for pipe in self._pipes:
+            try:
+                pipe.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+        self._pipes = []
+        self._processes = []
+
+    async def serve(self, host="127.0.0.1", port=8700, unix_path=None):
+        """Accept connections until cancelled"""
+        self._loop = asyncio.get_running_loop()
+        for pipe in self._pipes:
+            threading.Thread(target=self._read_replies, args=(pipe,),
+                             daemon=True).start()
+        if unix_path:
+            server = await asyncio.start_unix_server(self._client, unix_path)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self._client, host, port)
+            where = "{}:{}".format(*server.sockets[0].getsockname()[:2])
+        print(f"SemireGPT server listening on {where} "
+              f"({self.workers} worker processes)")
+        async with server:
+            await server.serve_forever()
+
+    async def request(self, request):
+        """Send one request to its shard and await the reply"""
+        token = next(self._tokens)
+        future = self._loop.create_future()
+        self._pending[token] = future
+        shard = shard_for(request["session"], self.workers)
+        self._pipes[shard].send((token, request))
+        return await future
+
+    def _read_replies(self, pipe):
+        """Background thread: hand worker replies to the event loop"""
+        while True:
+            try:
+                token, reply = pipe.recv()
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._resolve, token, reply)
+
+    def _resolve(self, token, reply):
+        future = self._pending.pop(token, None)
+        if future is not None and not future.done():
+            future.set_result(reply)
+
+    async def _client(self, reader, writer):
+        """Serve one connection; requests may be pipelined"""
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(request):
+            reply = await self.request(request)
+            async with write_lock:
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request = None
+                try:
+                    request = json.loads(line)
+                    session_id = str(request["session"])
+                    if not SESSION_ID_RE.fullmatch(session_id):
+                        raise ValueError("invalid session id")
+                    request["session"] = session_id
+                except (ValueError, KeyError, TypeError) as e:
+                    # Echo the id: pipelined replies arrive out of order
+                    reply = {"error": f"bad request: {e}"}
+                    if isinstance(request, dict):
+                        reply["id"] = request.get("id")
+                    async with write_lock:
+                        writer.write(json.dumps(reply).encode() + b"\n")
+                    continue
+                task = asyncio.ensure_future(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+
+def run_server(host="127.0.0.1", port=8700, unix_path=None, **options):
+    """Start worker processes and serve until interrupted"""
+    raise_fd_limit()  # for client connections
+    server = ShardedServer(**options)
+    server.start_workers()
+    try:
+        asyncio.run(server.serve(host, port, unix_path))
+    except KeyboardInterrupt:
+        print("\nShutting down SemireGPT server")
+    finally:
+        server.stop_workers()
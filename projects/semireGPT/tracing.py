@@ -0,0 +1,284 @@
+"""
+Opt-in latency tracing for SemireGPT
+
+A Tracer times named spans (stages such as "generate" or "journal") with
+time.perf_counter_ns() and records each duration in a LatencyHistogram:
+HDR-style buckets that are exponential in magnitude and linear within a
+magnitude, so any percentile is accurate to about 1% in a fixed amount
+of memory, no matter how many samples are recorded.
+
+A disabled tracer hands out one shared no-op span, so leaving the
+instrumentation in place costs almost nothing.
+
+Tracing is enabled per SemireGPT (tracer=Tracer()) or for the whole
+process with the SEMIRE_TRACE environment variable. SEMIRE_TRACE_DUMP
+names a JSON file that the stats are written to periodically.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from array import array
+
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram of non-negative integer durations (nanoseconds)
+
+    Args:
+        significant_bits: Bits of precision kept per value (7 = 128
+            linear sub-buckets per power of two, under 1% error)
+    """
+
+    def __init__(self, significant_bits=7):
+        self.significant_bits = significant_bits
+        self._half = 1 << (significant_bits - 1)
+        self._counts = array("Q", bytes(8 * (64 - significant_bits + 2) *
+                                        self._half))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        """Add one sample"""
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - self.significant_bits
+        if shift <= 0:
+            index = value
+        else:
+            index = shift * self._half + (value >> shift)
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Return the value at a percentile (0-100), or 0 when empty"""
+        if not self.count:
+            return 0
+        # Rank of the sample we want (1-based), rounded up
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            if bucket_count:
+                seen += bucket_count
+                if seen >= rank:
+                    return min(self._bucket_value(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        """Add another histogram's samples (same significant_bits)"""
+        for index, bucket_count in enumerate(other._counts):
+            if bucket_count:
+                self._counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def _bucket_value(self, index):
+        """Midpoint of the values that land in a bucket"""
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        low = (index - shift * self._half) << shift
+        return low + (1 << shift) // 2
+
+
+class _Span:
+    """Times one with-block and records it on exit"""
+
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.tracer.record(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+
+class _NullSpan:
+    """Shared span handed out by a disabled tracer"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Named latency histograms fed by spans
+
+    Args:
+        enabled: Record spans (a disabled tracer records nothing)
+        significant_bits: Histogram precision (see LatencyHistogram)
+
+    Usage:
+        tracer = Tracer()
+        with tracer.span("generate"):
+            ...
+        tracer.stats()["generate"]["p99_ms"]
+    """
+
+    def __init__(self, enabled=True, significant_bits=7):
+        self.enabled = enabled
+        self.significant_bits = significant_bits
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._dump_thread = None
+        self._dump_stop = None
+
+    def span(self, name):
+        """Return a context manager that times its block as name"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def iterate(self, name, iterable):
+        """
+        Yield from iterable, recording the time spent producing items as
+        name (time the consumer holds each item is not counted)
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        elapsed = 0
+        try:
+            while True:
+                start = time.perf_counter_ns()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter_ns() - start
+                yield item
+        finally:
+            self.record(name, elapsed)
+
+    def record(self, name, duration_ns):
+        """Record a duration measured elsewhere"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram(self.significant_bits)
+                self._histograms[name] = histogram
+            histogram.record(duration_ns)
+
+    def stats(self):
+        """
+        Return per-span latency summaries
+
+        Returns:
+            {name: {"count", "mean_ms", "min_ms", "p50_ms", "p99_ms",
+            "p999_ms", "max_ms"}}
+        """
+        with self._lock:
+            summary = {}
+            for name, histogram in sorted(self._histograms.items()):
+                count = histogram.count
+                summary[name] = {
+                    "count": count,
+                    "mean_ms": histogram.total / count / 1e6,
+                    "min_ms": histogram.min / 1e6,
+                    "p50_ms": histogram.percentile(50) / 1e6,
+                    "p99_ms": histogram.percentile(99) / 1e6,
+                    "p999_ms": histogram.percentile(99.9) / 1e6,
+                    "max_ms": histogram.max / 1e6,
+                }
+            return summary
+
+    def reset(self):
+        """Forget every recorded sample"""
+        with self._lock:
+            self._histograms.clear()
+
+    def dump(self, filename):
+        """Write stats() to a JSON file (atomically, via a temp file)"""
+        report = {"time": time.time(), "pid": os.getpid(),
+                  "spans": self.stats()}
+        temp_path = f"{filename}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(temp_path, filename)
+
+    def start_dump(self, filename, interval=60.0):
+        """Dump stats to filename every interval seconds (and on close)"""
+        self.stop_dump()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.dump(filename)
+            self.dump(filename)
+
+        self._dump_stop = stop
+        self._dump_thread = threading.Thread(target=run, daemon=True,
+                                             name="semire-trace-dump")
+        self._dump_thread.start()
+
+    def stop_dump(self):
+        """Stop periodic dumps after writing a final one"""
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+    def close(self):
+        """Stop periodic dumps"""
+        self.stop_dump()
+
+
+DISABLED = Tracer(enabled=False)
+
+_process_tracer = None
+_process_tracer_lock = threading.Lock()
+
+
+def default_tracer():
+    """
+    Return the process-wide tracer configured from the environment
+
+    SEMIRE_TRACE=1 enables it; SEMIRE_TRACE_DUMP=path starts periodic
+    JSON dumps every SEMIRE_TRACE_INTERVAL seconds (default 60). A
+    "{pid}" in the path is replaced by the process id.
+    Returns the disabled tracer when SEMIRE_TRACE is unset.
+    """
+    global _process_tracer
+    if os.getenv("SEMIRE_TRACE", "") in ("", "0"):
+        return DISABLED
+    with _process_tracer_lock:
+        if _process_tracer is None:
+            _process_tracer = Tracer()
+            dump_path = os.getenv("SEMIRE_TRACE_DUMP")
+            if dump_path:
+                dump_path = dump_path.replace("{pid}", str(os.getpid()))
+                interval = float(os.getenv("SEMIRE_TRACE_INTERVAL", "60"))
+                _process_tracer.start_dump(dump_path, interval)
+                atexit.register(_process_tracer.stop_dump)
+        return _process_tracer